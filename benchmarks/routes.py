@@ -0,0 +1,245 @@
+"""Drives the API with a realistic mix of searches, discoveries, image infos &
+visualizations, and reports the throughput & latency percentiles per route.
+
+Usage: python benchmarks/routes.py [--setup] [--url http://localhost:8000]
+           [--concurrency 4] [--duration 30] [--out bench.json] [--compare old.json]
+
+Runs against the database configured in .env, e.g. the docker-compose
+container: `docker-compose up -d`, then `--setup` (once) loads backup/.
+Without --url, requests go through the Flask app in-process, which leaves
+out the network & gunicorn but keeps every query & serialization cost.
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import requests
+
+from server import snapshot
+
+BACKUP_DIR = f"{os.path.abspath(os.curdir)}/backup"
+
+# Share of each route in the mix, loosely following a browsing session:
+# search, open a few images, discover, sometimes visualize
+MIX = {
+    "GET /api/search/keyword": 35,
+    "GET /api/info/image": 30,
+    "GET /api/search/discover": 20,
+    "POST /api/search/visualizesearch": 7,
+    "POST /api/search/visualizeimage": 8,
+}
+
+
+class Client:
+    """Sends requests either to a running server or to the in-process app."""
+
+    def __init__(self, url: Optional[str]) -> None:
+        self.url = url
+        if url:
+            self.session = requests.Session()
+        else:
+            from server.server import app
+
+            self.test_client = app.test_client()
+
+    def request(
+        self, method: str, path: str, params: dict = None, body: dict = None
+    ) -> Tuple[int, Optional[dict]]:
+        if self.url:
+            response = self.session.request(
+                method, f"{self.url}{path}", params=params, json=body, timeout=60
+            )
+            status = response.status_code
+            data = response.json() if response.content else None
+        else:
+            response = self.test_client.open(
+                path, method=method, query_string=params, json=body
+            )
+            status, data = response.status_code, response.get_json(silent=True)
+
+        return status, data
+
+
+def load(collection: str) -> List[dict]:
+    """Reads a collection of backup/, in either of its formats."""
+    path = snapshot.collection_path(BACKUP_DIR, collection)
+    if path is None:
+        raise FileNotFoundError(f"No backup for {collection} in {BACKUP_DIR}")
+
+    return list(snapshot.read_collection(path, collection))
+
+
+class Workload:
+    """Builds requests from the backup/ dataset, so that runs are comparable."""
+
+    def __init__(self, seed: int) -> None:
+        self.random = random.Random(seed)
+        self.keywords = [tag["tag"].lower() for tag in load("Tag")]
+        self.image_keys = [image["_key"] for image in load("Image")]
+        self.handles: List[str] = []
+        self.lock = threading.Lock()
+
+    def next(self) -> Tuple[str, str, str, dict, dict]:
+        with self.lock:
+            route = self.random.choices(list(MIX), weights=list(MIX.values()))[0]
+            keys = self.random.sample(self.image_keys, self.random.randint(1, 5))
+            keyword = " ".join(self.random.sample(self.keywords, 2))
+            handle = self.random.choice(self.handles) if self.handles else None
+
+        if route.endswith("/visualizesearch") and handle is None:
+            route = "GET /api/search/keyword"
+
+        method, path = route.split(" ")
+        if route.endswith("/keyword"):
+            return route, method, path, {"keyword": keyword}, None
+        if route.endswith("/image"):
+            return route, method, path, {"id": keys[0]}, None
+        if route.endswith("/discover"):
+            return route, method, path, {"IDs": ",".join(keys)}, None
+        if route.endswith("/visualizesearch"):
+            return route, method, path, None, {"handle": handle}
+
+        return route, method, path, None, {"imageID": keys}
+
+    def remember(self, data: Optional[dict]) -> None:
+        if isinstance(data, dict) and data.get("handle"):
+            with self.lock:
+                self.handles = (self.handles + [data["handle"]])[-100:]
+
+
+def run(
+    url: Optional[str], workload: Workload, concurrency: int, duration: float
+) -> Tuple[Dict[str, List[float]], Dict[str, int], float]:
+    timings: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    deadline = time.monotonic() + duration
+
+    def worker():
+        client = Client(url)
+        while time.monotonic() < deadline:
+            route, method, path, params, body = workload.next()
+            start = time.perf_counter()
+            try:
+                status, data = client.request(method, path, params, body)
+            except requests.RequestException as e:
+                print(e)
+                status, data = 599, None
+
+            ms = (time.perf_counter() - start) * 1000
+            timings[route].append(ms)
+            if status >= 500:
+                errors[route] += 1
+            workload.remember(data)
+
+    start = time.monotonic()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return timings, errors, time.monotonic() - start
+
+
+def percentile(timings: List[float], q: int) -> float:
+    if len(timings) < 2:
+        return timings[0] if timings else 0
+    return statistics.quantiles(timings, n=100, method="inclusive")[q - 1]
+
+
+def report(timings: List[float], errors: int, elapsed: float) -> Dict[str, float]:
+    return {
+        "requests": len(timings),
+        "errors": errors,
+        "rps": round(len(timings) / elapsed, 2),
+        "mean": round(statistics.mean(timings), 2) if timings else 0,
+        "p50": round(percentile(timings, 50), 2),
+        "p99": round(percentile(timings, 99), 2),
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results: dict, baseline: Optional[dict]) -> None:
+    header = (
+        f"{'route':<36} {'req/s':>8} {'p50 (ms)':>10} {'p99 (ms)':>10} {'errors':>7}"
+    )
+    print(header + (f" {'Δ p50':>8} {'Δ p99':>8}" if baseline else ""))
+    for route, r in results["routes"].items():
+        line = (
+            f"{route:<36} {r['rps']:>8} {r['p50']:>10} {r['p99']:>10} {r['errors']:>7}"
+        )
+        old = (baseline or {}).get("routes", {}).get(route)
+        if old:
+            for q in ["p50", "p99"]:
+                delta = (r[q] - old[q]) / old[q] * 100 if old[q] else 0
+                line += f" {delta:>+7.1f}%"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--setup", action="store_true", help="Load backup/ first")
+    parser.add_argument("--url", help="Server to benchmark, defaults to in-process")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=30, help="In seconds")
+    parser.add_argument("--warmup", type=float, default=5, help="In seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="bench.json")
+    parser.add_argument("--compare", help="A previous --out file to compare with")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+    if args.setup:
+        for script in ["scripts/onboard.py", "scripts/restore.py"]:
+            subprocess.run([sys.executable, script], check=True)
+
+    if args.warmup:
+        run(args.url, Workload(args.seed), args.concurrency, args.warmup)
+
+    workload = Workload(args.seed)
+    timings, errors, elapsed = run(args.url, workload, args.concurrency, args.duration)
+
+    results = {
+        "commit": git_commit(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "config": {
+            "url": args.url,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "seed": args.seed,
+        },
+        "total": report(sum(timings.values(), []), sum(errors.values()), elapsed),
+        "routes": {
+            route: report(timings[route], errors[route], elapsed)
+            for route in sorted(timings)
+        },
+    }
+    with open(args.out, "w") as file:
+        json.dump(results, file, indent=2)
+
+    print_results(results, baseline)
+    print(f"Total: {results['total']['rps']} req/s, written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
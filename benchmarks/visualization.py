@@ -0,0 +1,85 @@
+"""Compares the fused image visualization query against the former path,
+which ran fetch_discovery first and sent its documents back as a bind var.
+
+Usage: python benchmarks/visualization.py [--runs 20]
+(Requires a populated database, see the README)
+"""
+
+import argparse
+import statistics
+import time
+from typing import Callable, List
+
+from server import aql, arango
+
+LEGACY_AQL = """
+  WITH Image, Author, Tag, BestGuess
+  LET startEdges = (
+    FOR i IN Image
+      FILTER i._key IN @clicked_images
+      LET edges = (FOR v, e IN 1..1 INBOUND i._id AuthorOf, TagOf, BestGuessOf RETURN e)
+      RETURN {
+        i : {_id: i._id, _key: i._key, author: i.author, url: i.url, color: '#FF36AB'},
+        edges
+      }
+  )
+  LET vertices = (
+    FOR i IN Image
+      FILTER i._key IN @clicked_images
+      FOR v, e IN 1..1 INBOUND i AuthorOf, TagOf, BestGuessOf OPTIONS {bfs: true, uniqueVertices: 'global' }
+        LET vertice = {
+          _key: v._key,
+          _id: v._id,
+          data: v.author OR v.tag OR v.bestGuess,
+          color: v.author ? '#E9D758' : (v.tag ? '#297373' : '#FF8552')
+        }
+        RETURN DISTINCT vertice
+  )
+  LET endEdges = (
+    FOR i IN @similar_images
+      LET edges = (FOR v, e IN 1..1 INBOUND i._id AuthorOf, TagOf, BestGuessOf RETURN e)
+      RETURN {i, edges}
+  )
+  RETURN {vertices, connections: APPEND(startEdges, endEdges)}
+"""
+
+
+def legacy_image_visualization(clicked_images: List[str]):
+    similar_images = aql.fetch_discovery(clicked_images)
+    bind_vars = {"clicked_images": clicked_images, "similar_images": similar_images}
+    return arango.query(LEGACY_AQL, bind_vars=bind_vars).next()
+
+
+def time_ms(func: Callable, clicked_images: List[str], runs: int) -> List[float]:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func(clicked_images)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'clicked':>8} {'path':>8} {'p50 (ms)':>10} {'mean (ms)':>10}")
+    for count in [1, 5, 20]:
+        aql_sample = "FOR i IN Image SORT RAND() LIMIT @count RETURN i._key"
+        clicked_images = list(arango.query(aql_sample, {"count": count}))
+
+        paths = [
+            ("legacy", legacy_image_visualization),
+            ("fused", aql.fetch_image_visualization),
+        ]
+        for name, func in paths:
+            func(clicked_images)  # Warm up the query cache & plan
+            timings = time_ms(func, clicked_images, args.runs)
+            p50, mean = statistics.median(timings), statistics.mean(timings)
+            print(f"{count:>8} {name:>8} {p50:>10.2f} {mean:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -125,7 +125,7 @@ const Search = (props: any) => {
       if (response.status === 200) {
         const result = await response.json();
         setSearchResult(result.data);
-        updateCache(input, isImageURL ? result.keyword : index, result.data, isImageURL);
+        updateCache(input, isImageURL ? result.keyword : index, result.data, result.handle, isImageURL);
       } else if (response.status === 204) {
         setResultIsEmpty(true);
       } else {
@@ -151,7 +151,7 @@ const Search = (props: any) => {
       setTextFieldInput(result.keyword);
       setSearchResult(result.data);
       setResultIsEmpty(result.data.length === 0);
-      updateCache(result.keyword, result.keyword.split(' ').sort().join(' ').toLowerCase(), result.data, false);
+      updateCache(result.keyword, result.keyword.split(' ').sort().join(' ').toLowerCase(), result.data, result.handle, false);
     } else {
       setSorryAlert(true);
     }
@@ -211,15 +211,17 @@ const Search = (props: any) => {
    *
    * @param index The index of the cache
    * @param data  The data to store
+   * @param handle The search handle, used to visualize the results
    */
   // eslint-disable-next-line @typescript-eslint/no-explicit-any
-  const updateCache = async (input: string, index: string, data: any[], isImageURL: boolean) => {
+  const updateCache = async (input: string, index: string, data: any[], handle: string, isImageURL: boolean) => {
     if (data.length !== 0) {
       setPersistedData({
         ...persistedData,
         [index]: {
           input,
           data,
+          handle,
           isImageURL,
           date: Date(),
         },
@@ -89,19 +89,34 @@ const Visualize = (props: any) => {
     }
 
     const url = `/api/search/visualize${isSearchVisualization ? 'search' : 'image'}`;
-    const body = {
-      lastSearch: isSearchVisualization ? lastSearch : undefined,
-      lastResult: isSearchVisualization ? persistedData[lastSearch].data : undefined,
-      imageID: isSearchVisualization ? undefined : props.match.params.id.split(','),
+    const visualize = (handle?: string) =>
+      fetch(url, {
+        method: 'POST',
+        body: JSON.stringify({
+          handle,
+          imageID: isSearchVisualization ? undefined : props.match.params.id.split(','),
+        }),
+        headers: {
+          'Content-Type': 'application/json',
+        },
+      });
+
+    /**
+     * Search handles are short-lived: if it expired (or predates handles), search again for a new one
+     */
+    const visualizeSearch = async () => {
+      const handle: string | undefined = persistedData[lastSearch].handle;
+      const response = handle ? await visualize(handle) : undefined;
+      if (response && response.status !== 410) {
+        return response;
+      }
+
+      const keyword = persistedData[lastSearch].isImageURL ? lastSearch : persistedData[lastSearch].input;
+      const search = await fetch(`/api/search/keyword?keyword=${encodeURIComponent(keyword)}`);
+      return search.status === 200 ? visualize((await search.json()).handle) : search;
     };
 
-    fetch(url, {
-      method: 'POST',
-      body: JSON.stringify(body),
-      headers: {
-        'Content-Type': 'application/json',
-      },
-    })
+    (isSearchVisualization ? visualizeSearch() : visualize())
       .then(result => (result.status === 200 ? result.json() : undefined))
       .then(response => {
         if (response) {
@@ -0,0 +1,85 @@
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from arango.typings import Json
+
+from server import arango
+from server.snapshot import MANIFEST
+
+# _id is derivable from the collection & _key, and _rev is reassigned on import
+EXPORT_AQL = "FOR d IN @@collection RETURN UNSET(d, '_id', '_rev')"
+
+
+def backup(backup_dir: str, collection: str, batch_size: int) -> Json:
+    """Streams a collection into <collection>.ndjson.gz. Returns its manifest entry."""
+    file_name = f"{collection}.ndjson.gz"
+    path = f"{backup_dir}/{file_name}"
+    checksum, rows = hashlib.sha256(), 0
+
+    start = time.perf_counter()
+    cursor = arango.query(
+        EXPORT_AQL,
+        bind_vars={"@collection": collection},
+        name="backup",
+        batch_size=batch_size,
+        stream=True,
+    )
+    # mtime=0 keeps the file identical across backups of identical data
+    with open(f"{path}.tmp", "wb") as raw, gzip.GzipFile(
+        fileobj=raw, mode="wb", mtime=0
+    ) as file:
+        for doc in cursor:
+            line = json.dumps(doc, separators=(",", ":"), ensure_ascii=False)
+            line = f"{line}\n".encode()
+            checksum.update(line)
+            file.write(line)
+            rows += 1
+    os.replace(f"{path}.tmp", path)
+
+    elapsed = time.perf_counter() - start
+    size = os.path.getsize(path) / 1024
+    logging.info(
+        f"{collection}: {rows} rows, {size:.0f} KB in {elapsed:.1f}s "
+        f"({rows / elapsed:.0f} rows/s)"
+    )
+    return {"file": file_name, "rows": rows, "sha256": checksum.hexdigest()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backs up the database")
+    parser.add_argument("--dir", default=f"{os.path.abspath(os.curdir)}/backup")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    os.makedirs(args.dir, exist_ok=True)
+    # SimilarTo & Meta are derived, restore.py recomputes them
+    collections = arango.DOCUMENT_COLLECTIONS + arango.EDGE_COLLECTIONS
+    generation = arango.generation()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        entries = executor.map(
+            lambda c: backup(args.dir, c, args.batch_size), collections
+        )
+        manifest = {
+            "format": "ndjson.gz",
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "generation": generation,
+            "collections": dict(zip(collections, entries)),
+        }
+
+    # Written last: after an interrupted backup, restore.py's checks fail
+    # instead of restoring a mix of old & new files
+    with open(f"{args.dir}/{MANIFEST}", "w") as file:
+        json.dump(manifest, file, indent=2)
+
+    logging.info(f"Success: Backup of generation {generation} complete.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""Rewrites the keys of the Author, Tag & BestGuess vertices and of their edges
+from the former decimal code point encoding to server/keys.py's.
+
+Usage: python scripts/migrate_keys.py [--database] [--backup backup/]
+Both are idempotent: documents already keyed by label hash are left as is.
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import os
+from typing import Dict, Iterable, Iterator
+
+from arango.typings import Json
+
+from server import arango, snapshot
+from server.keys import KEY_LENGTH, edge_key, vertex_key
+
+# (vertex collection, label field, edge collection)
+KEYED_BY_LABEL = [
+    ("Author", "author", "AuthorOf"),
+    ("Tag", "tag", "TagOf"),
+    ("BestGuess", "bestGuess", "BestGuessOf"),
+]
+
+# AQL counterparts of server/keys.py
+VERTEX_KEY_AQL = f"SUBSTRING(SHA1(d[@field]), 0, {KEY_LENGTH})"
+EDGE_KEY_AQL = (
+    "SUBSTRING(SHA1(CONCAT(from_key, '-', PARSE_IDENTIFIER(e._to).key)), "
+    f"0, {KEY_LENGTH})"
+)
+
+
+def migrate_database(vertices: str, field: str, edges: str):
+    """Copies every document to its new key, then removes the old ones, as
+    ArangoDB keys cannot be updated in place."""
+    bind_vars = {"@vertices": vertices, "field": field}
+    copy_vertices = f"""
+        FOR d IN @@vertices
+            FILTER d[@field] != null
+            LET key = {VERTEX_KEY_AQL}
+            FILTER d._key != key
+            INSERT MERGE(UNSET(d, '_id', '_rev'), {{_key: key}}) INTO @@vertices
+                OPTIONS {{ overwriteMode: 'ignore' }}
+    """
+    arango.query(copy_vertices, bind_vars, name="migrate_keys")
+
+    # Edges still reach their old vertex, where the label is read from
+    edge_keys = f"""
+        LET d = DOCUMENT(e._from)
+        FILTER d[@field] != null
+        LET from_key = {VERTEX_KEY_AQL}
+        LET key = {EDGE_KEY_AQL}
+        LET from_id = CONCAT(@vertices, '/', from_key)
+    """
+    copy_edges = f"""
+        FOR e IN @@edges
+            {edge_keys}
+            FILTER e._key != key
+            INSERT MERGE(UNSET(e, '_id', '_rev'), {{_key: key, _from: from_id}}) INTO @@edges
+                OPTIONS {{ overwriteMode: 'ignore' }}
+    """
+    remove_edges = f"""
+        FOR e IN @@edges
+            {edge_keys}
+            FILTER e._key != key OR e._from != from_id
+            REMOVE e IN @@edges
+    """
+    edge_bind_vars = {"@edges": edges, "vertices": vertices, "field": field}
+    arango.query(copy_edges, edge_bind_vars, name="migrate_keys")
+    arango.query(remove_edges, edge_bind_vars, name="migrate_keys")
+
+    remove_vertices = f"""
+        FOR d IN @@vertices
+            FILTER d[@field] != null AND d._key != {VERTEX_KEY_AQL}
+            REMOVE d IN @@vertices
+    """
+    arango.query(remove_vertices, bind_vars, name="migrate_keys")
+    logging.info(f"Migrated {vertices} & {edges}")
+
+
+def migrate_backup(backup_dir: str):
+    """Rewrites the backup files in their own format, fixing up the manifest."""
+    manifest = snapshot.load_manifest(backup_dir)
+    for vertices, field, edges in KEYED_BY_LABEL:
+        new_keys: Dict[str, str] = {}
+
+        def rekey_vertices(docs: Iterable[Json]) -> Iterator[Json]:
+            for doc in docs:
+                key = vertex_key(doc[field])
+                new_keys[doc["_key"]] = key
+                yield {**doc, "_key": key, "_id": f"{vertices}/{key}"}
+
+        def rekey_edges(docs: Iterable[Json]) -> Iterator[Json]:
+            for doc in docs:
+                _, from_key = doc["_from"].split("/", 1)
+                from_key = new_keys.get(from_key, from_key)
+                key = edge_key(from_key, doc["_to"].split("/", 1)[1])
+                yield {
+                    **doc,
+                    "_key": key,
+                    "_id": f"{edges}/{key}",
+                    "_from": f"{vertices}/{from_key}",
+                }
+
+        for collection, rekey in [(vertices, rekey_vertices), (edges, rekey_edges)]:
+            path = snapshot.collection_path(backup_dir, collection)
+            if path is None:
+                logging.warning(f"No backup for {collection}, skipping")
+                continue
+
+            docs = rekey(snapshot.read_collection(path, collection))
+            if manifest is None:
+                write_json_array(path, docs)
+            else:
+                entry = manifest["collections"][collection]
+                entry["rows"], entry["sha256"] = write_ndjson(path, docs)
+
+            logging.info(f"Migrated {path}")
+
+    if manifest is not None:
+        with open(f"{backup_dir}/{snapshot.MANIFEST}", "w") as file:
+            json.dump(manifest, file, indent=2)
+
+
+def write_json_array(path: str, docs: Iterable[Json]):
+    with open(f"{path}.tmp", "w") as file:
+        file.write("[")
+        for i, doc in enumerate(docs):
+            file.write(("," if i else "") + json.dumps(doc, separators=(",", ":")))
+        file.write("]")
+    os.replace(f"{path}.tmp", path)
+
+
+def write_ndjson(path: str, docs: Iterable[Json]):
+    checksum, rows = hashlib.sha256(), 0
+    with open(f"{path}.tmp", "wb") as raw, gzip.GzipFile(
+        fileobj=raw, mode="wb", mtime=0
+    ) as file:
+        for doc in docs:
+            doc.pop("_id", None)
+            line = json.dumps(doc, separators=(",", ":"), ensure_ascii=False)
+            line = f"{line}\n".encode()
+            checksum.update(line)
+            file.write(line)
+            rows += 1
+    os.replace(f"{path}.tmp", path)
+    return rows, checksum.hexdigest()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database", action="store_true", help="Migrate the DB")
+    parser.add_argument("--backup", help="Migrate the backup in this directory")
+    args = parser.parse_args()
+
+    if args.database:
+        for vertices, field, edges in KEYED_BY_LABEL:
+            migrate_database(vertices, field, edges)
+        arango.bump_generation()
+
+    if args.backup:
+        migrate_backup(args.backup)
+
+    logging.info("Success: Key migration complete.")
+
+
+if __name__ == "__main__":
+    main()
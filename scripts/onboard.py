@@ -12,7 +12,10 @@ def main():
     for collection in arango.EDGE_COLLECTIONS:
         arango.create_collection(collection, is_edge_collection=True)
 
+    arango.create_collection(arango.SIMILARITY_COLLECTION, is_edge_collection=True)
+
     arango.create_graph("picsumvision", arango.EDGE_DEFINITIONS)
+    arango.create_geo_index("TagOf", "_location")
 
     arango.create_analyzer(
         name="text_en_stopwords",
@@ -86,6 +89,7 @@ def main():
         },
     )
 
+    arango.bump_generation()
     logging.info("Success: Onboarding complete.")
 
 
@@ -1,11 +1,17 @@
+import argparse
 import json
 import logging
-from typing import List, Tuple
+import queue
+import threading
+import time
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
 
 import requests
 from colornamer import get_color_from_rgb
 
 from server import arango, vision
+from server.controllers.arangodb import BulkWriter, StagedWrites
+from server.keys import edge_key, vertex_key
 from server.typings import (
     AbstractImage,
     ArangoImage,
@@ -21,6 +27,22 @@ from server.typings import (
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Populate the Picsum Vision graph.")
+    parser.add_argument("--pipeline", action="store_true", help="pipelined ingest")
+    parser.add_argument("--vision-workers", type=int, default=4)
+    parser.add_argument("--arango-writers", type=int, default=2)
+    parser.add_argument("--queue-size", type=int, default=8)
+    args = parser.parse_args()
+
+    if args.pipeline:
+        populate_db_pipelined(
+            iter_lorem_picsum_images(),
+            vision_workers=args.vision_workers,
+            arango_writers=args.arango_writers,
+            queue_size=args.queue_size,
+        )
+        return
+
     picsum_dataset: List[AbstractImage] = fetch_lorem_picsum_images()
     # unsplash_dataset: List[AbstractImage] = fetch_unsplash_images()
 
@@ -30,73 +52,300 @@ def main():
 def populate_db(dataset: List[AbstractImage]) -> None:
     logging.info(f"Generating metadata for {len(dataset)} images. Please standby...")
 
-    for image in dataset:
-        try:
-            img_doc: ArangoImage
-            img_doc, is_old_img = arango.insert(
-                "Image",
-                _key=image["key"],
-                author=image["author"],
-                url=image["url"],
-            )
+    new_image_keys: List[str] = []
+    with arango.bulk_writer() as writer:
+        for i in range(0, len(dataset), vision.BATCH_SIZE):
+            img_docs = find_new_images(dataset[i : i + vision.BATCH_SIZE])
+            if not img_docs:
+                continue
+
+            uris = [d["url"] for d in img_docs]
+            vision_batch = vision.get_image_metadata_batch(uris)
+            for img_doc in img_docs:
+                if insert_metadata(writer, img_doc, vision_batch.get(img_doc["url"])):
+                    new_image_keys.append(img_doc["_key"])
 
-            if is_old_img:
-                logging.info(f'Already exists: {img_doc["_id"]}, skipping...')
+    arango.update_similarity(new_image_keys)
+    arango.bump_generation()
+    logging.info("Success: Populating DB complete.")
+
+
+def populate_db_pipelined(
+    images: Iterable[AbstractImage],
+    vision_workers: int = 4,
+    arango_writers: int = 2,
+    queue_size: int = 8,
+) -> None:
+    """Runs the ingest as three stages connected by bounded queues:
+
+    1. list: streams Picsum images, in batches of images not yet in the DB
+    2. vision: a pool of workers annotating each batch with Google Vision
+    3. arango: a pool of writers buffering each image & its metadata into
+       a shared BulkWriter
+
+    A full queue blocks the stage feeding it, so a slow stage throttles the
+    stages before it instead of buffering the whole catalog in memory.
+    If a worker fails, every stage stops, and its error is raised once the
+    images already written are linked (see Failure).
+    """
+    logging.info("Pipelined ingest started. Please standby...")
+
+    failure = Failure()
+    new_image_keys: List[str] = []
+    batches: queue.Queue = queue.Queue(maxsize=queue_size)
+    annotated: queue.Queue = queue.Queue(maxsize=queue_size * vision.BATCH_SIZE)
+
+    def list_images(stage: Stage):
+        batch: List[AbstractImage] = []
+        for image in images:
+            batch.append(image)
+            if len(batch) == vision.BATCH_SIZE:
+                img_docs = stage.run(len(batch), find_new_images, batch)
+                if img_docs:
+                    failure.put(batches, img_docs)
+                batch = []
+
+        if batch:
+            img_docs = stage.run(len(batch), find_new_images, batch)
+            if img_docs:
+                failure.put(batches, img_docs)
+
+    def annotate_images(stage: Stage):
+        for img_docs in failure.iter_queue(batches):
+            uris = [d["url"] for d in img_docs]
+            vision_batch = stage.run(len(uris), vision.get_image_metadata_batch, uris)
+            for img_doc in img_docs:
+                failure.put(annotated, (img_doc, vision_batch.get(img_doc["url"])))
+
+    def write_images(stage: Stage):
+        for img_doc, vision_data in failure.iter_queue(annotated):
+            if stage.run(1, insert_metadata, writer, img_doc, vision_data):
+                new_image_keys.append(img_doc["_key"])
+
+    start = time.perf_counter()
+    with arango.bulk_writer() as writer:
+        stages = [
+            Stage("list", list_images, 1, failure, batches),
+            Stage("vision", annotate_images, vision_workers, failure, annotated),
+            Stage("arango", write_images, arango_writers, failure),
+        ]
+        for stage in stages:
+            stage.join()
+    elapsed = time.perf_counter() - start
+
+    arango.update_similarity(new_image_keys)
+    arango.bump_generation()
+    if failure.error is not None:
+        raise failure.error
+
+    written = stages[-1].items
+    rate = written / elapsed if elapsed else 0
+    logging.info(f"Success: {written} images in {elapsed:.1f}s ({rate:.2f} img/s)")
+    for stage in stages:
+        logging.info(str(stage))
+
+
+class Stopped(Exception):
+    """Raised in the workers of a pipeline that failed elsewhere."""
+
+
+class Failure:
+    """The first error of a pipeline's workers. Once it is set, the stages
+    stop feeding & reading their queues, so that none of them waits forever
+    on a neighbour that is gone."""
+
+    SENTINEL = None
+    POLL_INTERVAL = 0.5
+
+    def __init__(self) -> None:
+        self.event = threading.Event()
+        self.error: Optional[BaseException] = None
+        self.lock = threading.Lock()
+
+    def set(self, error: BaseException) -> None:
+        with self.lock:
+            if self.error is None:
+                self.error = error
+        self.event.set()
+
+    def put(self, q: queue.Queue, item) -> None:
+        while not self.event.is_set():
+            try:
+                q.put(item, timeout=self.POLL_INTERVAL)
+                return
+            except queue.Full:
                 continue
 
-            vision_data: dict = vision.get_image_metadata(img_doc["url"])
-            if not vision_data or "error" in vision_data:
-                logging.info(f"Error: Vision uncooperative")
-                print(json.dumps(vision_data.get("error"), indent=4))
-                arango.dissolve(img_doc["_id"])
+        raise Stopped()
 
-            author = img_doc["author"]
-            insert_author(img_doc, author)
+    def iter_queue(self, q: queue.Queue) -> Iterator:
+        while not self.event.is_set():
+            try:
+                item = q.get(timeout=self.POLL_INTERVAL)
+            except queue.Empty:
+                continue
+
+            if item is self.SENTINEL:
+                self.put(q, item)  # Let the sibling workers see the sentinel too
+                return
+            yield item
+
+        raise Stopped()
+
+
+class Stage:
+    """A pool of worker threads running `target`, with busy time & item counts.
+
+    Once every worker is done, a sentinel is pushed to `output` so that the
+    workers of the next stage know to stop. A worker error is recorded in
+    `failure`, which stops the other stages.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        target: Callable[["Stage"], None],
+        workers: int,
+        failure: Failure,
+        output: queue.Queue = None,
+    ):
+        self.name = name
+        self.failure = failure
+        self.items = 0
+        self.busy = 0.0
+        self.lock = threading.Lock()
+
+        self.threads = [
+            threading.Thread(target=self.work, args=(target,), daemon=True)
+            for _ in range(max(workers, 1))
+        ]
+        for thread in self.threads:
+            thread.start()
+
+        if output is not None:
+            threading.Thread(target=self.close, args=(output,), daemon=True).start()
+
+    def work(self, target: Callable[["Stage"], None]):
+        try:
+            target(self)
+        except Stopped:
+            pass
+        except BaseException as e:
+            logging.exception(f"Error: {self.name} worker stopped")
+            self.failure.set(e)
+
+    def run(self, items: int, func: Callable, *args):
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            with self.lock:
+                self.busy += time.perf_counter() - start
+                self.items += items
+
+    def close(self, output: queue.Queue):
+        self.join()
+        try:
+            self.failure.put(output, Failure.SENTINEL)
+        except Stopped:
+            pass
 
-            landmarks = vision_data.get("landmarkAnnotations", None)
-            if landmarks:
-                insert_landmarks(img_doc, landmarks)
+    def join(self):
+        for thread in self.threads:
+            thread.join()
 
-            web_detection: dict = vision_data.get("webDetection", None)
-            if web_detection:
-                guesses = web_detection.get("bestGuessLabels", None)
-                if guesses:
-                    insert_guesses(img_doc, guesses)
+    def __str__(self) -> str:
+        rate = self.items / self.busy if self.busy else 0
+        return f"{self.name}: {self.items} items, {self.busy:.1f}s busy ({rate:.2f}/s)"
 
-                entities = web_detection.get("webEntities", None)
-                if entities:
-                    insert_entities(img_doc, entities)
 
-            localized_objects = vision_data.get("localizedObjectAnnotations", None)
-            if localized_objects:
-                insert_localized_objects(img_doc, localized_objects)
+def find_new_images(images: List[AbstractImage]) -> List[ArangoImage]:
+    existing_keys = arango.existing_keys("Image", [i["key"] for i in images])
 
-            labels = vision_data.get("labelAnnotations", None)
-            if labels:
-                insert_labels(img_doc, labels)
+    img_docs: List[ArangoImage] = []
+    for image in images:
+        if image["key"] in existing_keys:
+            logging.info(f'Already exists: Image/{image["key"]}, skipping...')
+            continue
 
-            properties = vision_data.get("imagePropertiesAnnotation", None)
-            if properties:
-                colors = properties["dominantColors"]["colors"]
-                insert_colors(img_doc, colors)
+        img_docs.append(
+            {
+                "_id": f'Image/{image["key"]}',
+                "_key": image["key"],
+                "author": image["author"],
+                "url": image["url"],
+            }
+        )
 
-            logging.info(f"Success: {img_doc['_id']}")
+    return img_docs
 
-        except:
-            logging.info(f'Error: {img_doc["_id"]}')
-            arango.dissolve(img_doc["_id"])
 
-    logging.info("Success: Populating DB complete.")
+def insert_metadata(
+    bulk_writer: BulkWriter, img_doc: ArangoImage, vision_data: VisionResult
+) -> bool:
+    """Stages an image & its metadata, and hands them to the bulk writer
+    together, so that an image failing midway leaves nothing behind."""
+    if not vision_data or "error" in vision_data:
+        logging.info(f'Error: Vision uncooperative ({img_doc["_id"]})')
+        print(json.dumps((vision_data or {}).get("error"), indent=4))
+        return False
 
+    writer = bulk_writer.stage()
+    try:
+        writer.insert(
+            "Image",
+            _key=img_doc["_key"],
+            author=img_doc["author"],
+            url=img_doc["url"],
+        )
+
+        author = img_doc["author"]
+        insert_author(writer, img_doc, author)
+
+        landmarks = vision_data.get("landmarkAnnotations", None)
+        if landmarks:
+            insert_landmarks(writer, img_doc, landmarks)
+
+        web_detection: dict = vision_data.get("webDetection", None)
+        if web_detection:
+            guesses = web_detection.get("bestGuessLabels", None)
+            if guesses:
+                insert_guesses(writer, img_doc, guesses)
+
+            entities = web_detection.get("webEntities", None)
+            if entities:
+                insert_entities(writer, img_doc, entities)
+
+        localized_objects = vision_data.get("localizedObjectAnnotations", None)
+        if localized_objects:
+            insert_localized_objects(writer, img_doc, localized_objects)
+
+        labels = vision_data.get("labelAnnotations", None)
+        if labels:
+            insert_labels(writer, img_doc, labels)
+
+        properties = vision_data.get("imagePropertiesAnnotation", None)
+        if properties:
+            colors = properties["dominantColors"]["colors"]
+            insert_colors(writer, img_doc, colors)
+
+        writer.commit()
+        logging.info(f"Success: {img_doc['_id']}")
+        return True
+
+    except:
+        logging.info(f'Error: {img_doc["_id"]}')
+        return False
 
-def insert_author(image: ArangoImage, author: str):
-    _key = string_to_ascii(author)
+
+def insert_author(writer: StagedWrites, image: ArangoImage, author: str):
+    _key = vertex_key(author)
 
     try:
-        author, _ = arango.insert("Author", _key=_key, author=author)
-        arango.insert(
+        author = writer.insert("Author", _key=_key, author=author)
+        writer.insert(
             "AuthorOf",
-            _key=_key + image["_key"],
+            _key=edge_key(_key, image["_key"]),
             _from=author["_id"],
             _to=image["_id"],
             _score=2,
@@ -106,7 +355,9 @@ def insert_author(image: ArangoImage, author: str):
         print(e)
 
 
-def insert_landmarks(image: ArangoImage, landmarks: List[LandmarkAnnotation]):
+def insert_landmarks(
+    writer: StagedWrites, image: ArangoImage, landmarks: List[LandmarkAnnotation]
+):
     for landmark in landmarks:
         if is_valid_vision_data(landmark, {"description", "locations", "mid"}):
             _key, _score = fetch_key_and_score(landmark, "description")
@@ -115,43 +366,46 @@ def insert_landmarks(image: ArangoImage, landmarks: List[LandmarkAnnotation]):
             _longitude = landmark["locations"][0]["latLng"]["longitude"]
 
             try:
-                landmark_doc, _ = arango.insert(
+                landmark_doc = writer.insert(
                     "Tag",
                     _key=_key,
                     mid=landmark["mid"],
                     tag=landmark["description"],
                 )
 
-                arango.insert(
+                writer.insert(
                     "TagOf",
-                    _key=_key + image["_key"],
+                    _key=edge_key(_key, image["_key"]),
                     _from=landmark_doc["_id"],
                     _to=image["_id"],
                     _type="landmark",
                     _score=_score,
                     _latitude=_latitude,
                     _longitude=_longitude,
+                    _location={"type": "Point", "coordinates": [_longitude, _latitude]},
                 )
             except BaseException as e:
                 logging.info(f'ArangoDB Error: {landmark["description"]} (Landmark)')
                 print(e)
 
 
-def insert_guesses(image: ArangoImage, guesses: List[VisionGuess]):
+def insert_guesses(
+    writer: StagedWrites, image: ArangoImage, guesses: List[VisionGuess]
+):
     for guess in guesses:
         if {"label"} <= set(guess):
-            _key = string_to_ascii(guess["label"])
+            _key = vertex_key(guess["label"])
 
             try:
-                guess_doc, _ = arango.insert(
+                guess_doc = writer.insert(
                     "BestGuess",
                     _key=_key,
                     bestGuess=guess["label"],
                 )
 
-                arango.insert(
+                writer.insert(
                     "BestGuessOf",
-                    _key=_key + image["_key"],
+                    _key=edge_key(_key, image["_key"]),
                     _from=guess_doc["_id"],
                     _to=image["_id"],
                     _score=1,
@@ -161,22 +415,24 @@ def insert_guesses(image: ArangoImage, guesses: List[VisionGuess]):
                 print(e)
 
 
-def insert_entities(image: ArangoImage, entities: List[VisionAnnotation]):
+def insert_entities(
+    writer: StagedWrites, image: ArangoImage, entities: List[VisionAnnotation]
+):
     for entity in entities:
         if is_valid_vision_data(entity, {"entityId", "description"}):
             _key, _score = fetch_key_and_score(entity, "description")
 
             try:
-                entity_doc, _ = arango.insert(
+                entity_doc = writer.insert(
                     "Tag",
                     _key=_key,
                     mid=entity["entityId"],
                     tag=entity["description"],
                 )
 
-                arango.insert(
+                writer.insert(
                     "TagOf",
-                    _key=_key + image["_key"],
+                    _key=edge_key(_key, image["_key"]),
                     _from=entity_doc["_id"],
                     _to=image["_id"],
                     _type="label",
@@ -188,7 +444,9 @@ def insert_entities(image: ArangoImage, entities: List[VisionAnnotation]):
 
 
 def insert_localized_objects(
-    image: ArangoImage, localized_objects: List[LocalizedObjectAnnotation]
+    writer: StagedWrites,
+    image: ArangoImage,
+    localized_objects: List[LocalizedObjectAnnotation],
 ):
     for localized_object in localized_objects:
         if is_valid_vision_data(localized_object, {"mid", "name", "boundingPoly"}):
@@ -199,16 +457,16 @@ def insert_localized_objects(
             _coord.append(_coord[0])
 
             try:
-                localized_object_doc, _ = arango.insert(
+                localized_object_doc = writer.insert(
                     "Tag",
                     _key=_key,
                     mid=localized_object["mid"],
                     tag=localized_object["name"],
                 )
 
-                arango.insert(
+                writer.insert(
                     "TagOf",
-                    _key=_key + image["_key"],
+                    _key=edge_key(_key, image["_key"]),
                     _from=localized_object_doc["_id"],
                     _to=image["_id"],
                     _type="object",
@@ -220,22 +478,24 @@ def insert_localized_objects(
                 print(e)
 
 
-def insert_labels(image: ArangoImage, labels: List[VisionAnnotation]):
+def insert_labels(
+    writer: StagedWrites, image: ArangoImage, labels: List[VisionAnnotation]
+):
     for label in labels:
         if is_valid_vision_data(label, {"mid", "description"}):
             _key, _score = fetch_key_and_score(label, "description")
 
             try:
-                label_doc, _ = arango.insert(
+                label_doc = writer.insert(
                     "Tag",
                     _key=_key,
                     mid=label["mid"],
                     tag=label["description"],
                 )
 
-                arango.insert(
+                writer.insert(
                     "TagOf",
-                    _key=_key + image["_key"],
+                    _key=edge_key(_key, image["_key"]),
                     _from=label_doc["_id"],
                     _to=image["_id"],
                     _type="label",
@@ -246,7 +506,7 @@ def insert_labels(image: ArangoImage, labels: List[VisionAnnotation]):
                 print(e)
 
 
-def insert_colors(image: ArangoImage, colors: List[VisionColor]):
+def insert_colors(writer: StagedWrites, image: ArangoImage, colors: List[VisionColor]):
     for color in colors:
         if "color" not in color:
             continue
@@ -265,16 +525,16 @@ def insert_colors(image: ArangoImage, colors: List[VisionColor]):
         family: str = color_json["color_family"]
         hex: str = color_json["xkcd_color_hex"]
 
-        _key = string_to_ascii(family)
+        _key = vertex_key(family)
         _score = color["score"]
         _pixel_fraction = color["pixelFraction"]
 
         try:
-            color_doc, _ = arango.insert("Tag", _key=_key, tag=family, hex=hex)
+            color_doc = writer.insert("Tag", _key=_key, tag=family, hex=hex)
 
-            arango.insert(
+            writer.insert(
                 "TagOf",
-                _key=_key + image["_key"],
+                _key=edge_key(_key, image["_key"]),
                 _from=color_doc["_id"],
                 _to=image["_id"],
                 _type="label",
@@ -287,26 +547,24 @@ def insert_colors(image: ArangoImage, colors: List[VisionColor]):
 
 
 def fetch_lorem_picsum_images() -> List[AbstractImage]:
-    dataset: List[AbstractImage] = []
+    return list(iter_lorem_picsum_images())
 
+
+def iter_lorem_picsum_images() -> Iterator[AbstractImage]:
     page = 1
     url = "https://picsum.photos/v2/list?limit=100&page="
     picsum_result = fetch_from_endpoint(f"{url}{page}")
     while picsum_result:
         for picsum_object in picsum_result:
-            dataset.append(
-                {
-                    "key": str(picsum_object["id"]),
-                    "author": picsum_object["author"],
-                    "url": picsum_object["download_url"],
-                }
-            )
+            yield {
+                "key": str(picsum_object["id"]),
+                "author": picsum_object["author"],
+                "url": picsum_object["download_url"],
+            }
 
         page += 1
         picsum_result = fetch_from_endpoint(f"{url}{page}")
 
-    return dataset
-
 
 def fetch_from_endpoint(url: str):
     response = requests.get(url)
@@ -314,10 +572,6 @@ def fetch_from_endpoint(url: str):
     return response.json()
 
 
-def string_to_ascii(string: str) -> str:
-    return "".join(str(ord(c)) for c in string)
-
-
 def is_valid_vision_data(vision_data: dict, keys: List[str]) -> bool:
     return keys <= set(vision_data) and vision_data.get("score", 0) >= 0.3
 
@@ -325,7 +579,7 @@ def is_valid_vision_data(vision_data: dict, keys: List[str]) -> bool:
 def fetch_key_and_score(vision_data: dict, key: str) -> Tuple[str, float]:
     score = vision_data.get("score", 1)
     return (
-        string_to_ascii(vision_data[key]),
+        vertex_key(vision_data[key]),
         score if score < 1 else 0.999,
     )
 
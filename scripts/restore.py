@@ -1,13 +1,68 @@
-import json
+import argparse
+import logging
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
 
 from server import arango
+from server.snapshot import collection_path, read_collection, verify
+
+
+def restore(backup_dir: str, collection: str, batch_size: int) -> bool:
+    path = collection_path(backup_dir, collection)
+    if path is None:
+        logging.warning(f"No backup for {collection}, skipping")
+        return False
+
+    start = time.perf_counter()
+    count = arango.restore_collection(
+        collection, read_collection(path, collection), batch_size
+    )
+    elapsed = time.perf_counter() - start
+    logging.info(
+        f"{collection}: {count} rows in {elapsed:.1f}s ({count / elapsed:.0f} rows/s)"
+    )
+    return True
+
+
+def restore_all(
+    backup_dir: str, collections: List[str], workers: int, batch_size: int
+) -> List[str]:
+    """Restores collections in parallel. Returns those without a backup."""
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        restored = executor.map(
+            lambda c: restore(backup_dir, c, batch_size), collections
+        )
+        return [c for c, ok in zip(collections, list(restored)) if not ok]
 
 
 def main():
-    for collection in arango.DOCUMENT_COLLECTIONS + arango.EDGE_COLLECTIONS:
-        file = open(f"{os.path.abspath(os.curdir)}/backup/{collection}.json")
-        arango.restore_collection(collection, json.load(file))
+    parser = argparse.ArgumentParser(description="Restores the database from a backup")
+    parser.add_argument("--dir", default=f"{os.path.abspath(os.curdir)}/backup")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    problems = verify(args.dir)
+    if problems:
+        raise ValueError(f"Corrupt backup in {args.dir}: {'; '.join(problems)}")
+
+    start = time.perf_counter()
+    # Vertices first, so that no edge is restored before the vertices it joins
+    missing = restore_all(
+        args.dir, arango.DOCUMENT_COLLECTIONS, args.workers, args.batch_size
+    )
+    missing += restore_all(
+        args.dir, arango.EDGE_COLLECTIONS, args.workers, args.batch_size
+    )
+    if missing:
+        logging.warning(f"Restored without {', '.join(missing)}: no backup found")
+
+    arango.backfill_landmark_locations()
+    arango.refresh_similarity()
+    arango.bump_generation()
+    logging.info(f"Success: Restore complete in {time.perf_counter() - start:.1f}s.")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,10 @@
+from server import arango
+
+
+def main():
+    arango.refresh_similarity()
+    arango.bump_generation()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 import logging
 import os
+import runpy
 from pathlib import Path
 
 from dotenv import load_dotenv
@@ -7,7 +8,13 @@ from flask import Flask
 from flask_cors import CORS
 
 from server.controllers.arangodb import ArangoDriver
-from server.controllers.googlevision import VisionDriver
+from server.controllers.cache import ResultCache
+from server.controllers.googlevision import VisionCache, VisionDriver
+from server.controllers.http import HTTPPool
+from server.controllers.metrics import Metrics
+from server.controllers.singleflight import SingleFlight
+from server.controllers.suggest import SuggestIndex
+from server.responses import ResponseCache, encode_json
 
 load_dotenv()
 logging.basicConfig(
@@ -25,10 +32,110 @@ app = Flask(
 )
 cors = CORS(app)
 
+cache_dir = os.environ.get("CACHE_DIR", f"{Path(__file__).parent.parent}/.cache")
+metrics = Metrics(f"{cache_dir}/metrics.sqlite3")
+# Shares identical searches & Vision calls running concurrently in a worker
+flights = SingleFlight()
+
+
+def http_pool(name: str, read_timeout: float) -> HTTPPool:
+    return HTTPPool(
+        pool_size=int(os.environ.get(f"{name}_POOL_SIZE", 10)),
+        connect_timeout=float(os.environ.get("HTTP_CONNECT_TIMEOUT", 5)),
+        read_timeout=float(os.environ.get(f"{name}_TIMEOUT", read_timeout)),
+        keep_alive=os.environ.get("HTTP_KEEP_ALIVE", "true").lower() == "true",
+        compress=os.environ.get("HTTP_COMPRESSION", "true").lower() == "true",
+    )
+
+
 arango = ArangoDriver(
     os.environ.get("ARANGO_DB_URL"),
     os.environ.get("ARANGO_USER"),
     os.environ.get("ARANGO_PASS"),
     os.environ.get("ARANGO_DB_NAME"),
+    float(os.environ.get("GENERATION_POLL_INTERVAL", 1)),
+    metrics,
+    float(os.environ.get("SLOW_QUERY_MS", 500)),
+    http_pool("ARANGO", read_timeout=60),
+)
+query_debug_enabled = os.environ.get("AQL_DEBUG", "false").lower() == "true"
+
+vision_cache = VisionCache(
+    f"{cache_dir}/vision.sqlite3",
+    ttl=int(os.environ.get("VISION_CACHE_TTL", 7 * 24 * 60 * 60)),
+    max_entries=int(os.environ.get("VISION_CACHE_SIZE", 10000)),
 )
-vision = VisionDriver(os.environ.get("GOOGLE_APPLICATION_CREDENTIALS"))
+vision_pool = http_pool("VISION", read_timeout=30)
+# VISION_ASYNC=true multiplexes the Vision calls of a worker's threads on one loop
+if os.environ.get("VISION_ASYNC", "false").lower() == "true":
+    from server.controllers.asyncvision import AsyncVisionDriver
+
+    vision = AsyncVisionDriver(
+        os.environ.get("GOOGLE_APPLICATION_CREDENTIALS"),
+        vision_cache,
+        vision_pool,
+        flights,
+        concurrency=int(os.environ.get("VISION_CONCURRENCY", 8)),
+        timeout=vision_pool.timeout[1],
+    )
+    metrics.register("vision_async", vision.stats)
+else:
+    vision = VisionDriver(
+        os.environ.get("GOOGLE_APPLICATION_CREDENTIALS"),
+        vision_cache,
+        vision_pool,
+        flights,
+    )
+
+result_cache = ResultCache(
+    f"{cache_dir}/results.sqlite3",
+    max_entries=int(os.environ.get("RESULT_CACHE_SIZE", 10000)),
+)
+
+suggest_index = SuggestIndex()
+# SUGGEST_WARMUP=true builds the suggestions at startup, querying the database
+suggest_warmup = os.environ.get("SUGGEST_WARMUP", "false").lower() == "true"
+
+# FAST_JSON=true encodes the API responses with orjson
+if os.environ.get("FAST_JSON", "false").lower() == "true":
+    import orjson
+
+    encode_json = orjson.dumps
+
+response_cache = ResponseCache(
+    max_entries=int(os.environ.get("RESPONSE_CACHE_SIZE", 1024)),
+    gzip_min_bytes=int(os.environ.get("GZIP_MIN_BYTES", 1024)),
+    encode=encode_json,
+)
+
+# STATIC_ASSETS=precompressed serves the client build from compressed variants
+static_assets = None
+if os.environ.get("STATIC_ASSETS", "flask") == "precompressed":
+    from server.static import StaticAssets
+
+    static_assets = StaticAssets(app.static_folder)
+
+# GRAPH_BACKEND=memory answers searches & image infos from a copy of backup/
+memory = None
+if os.environ.get("GRAPH_BACKEND", "arango") == "memory":
+    from server.controllers.memory import MemoryGraph
+
+    root = Path(__file__).parent.parent
+    memory = MemoryGraph(
+        os.environ.get("MEMORY_GRAPH_DIR", f"{root}/backup"),
+        runpy.run_path(f"{root}/scripts/assets/stopwords.py")["stop_words"],
+    )
+
+# DISCOVERY_ENGINE=matrix ranks the common matches of discoveries in-process
+discovery = None
+if os.environ.get("DISCOVERY_ENGINE", "aql") == "matrix":
+    from server.controllers.discovery import DiscoveryMatrix
+
+    discovery = DiscoveryMatrix(arango)
+
+metrics.register("vision_cache", vision.cache.stats)
+metrics.register("arango_pool", arango.pool.stats)
+metrics.register("vision_pool", vision.pool.stats)
+metrics.register("result_cache", result_cache.stats)
+metrics.register("singleflight", flights.stats)
+metrics.register("response_cache", response_cache.stats)
@@ -1,9 +1,29 @@
+import base64
+import hashlib
+import json
 import math
 import random
-from typing import Dict, List
+from typing import Dict, Iterable, List, Optional, Tuple
 
-from server import arango
-from server.typings import ArangoImage, ArangoImageInfo, VisualizationData
+from server import arango, discovery, flights, memory, result_cache, suggest_index
+from server.controllers.arangodb import query_debug
+from server.typings import (
+    ArangoImage,
+    ArangoImageInfo,
+    ArangoSearch,
+    ArangoSearchMatches,
+    ArangoSearchPage,
+    ArangoSearchResult,
+    Suggestion,
+    VisualizationData,
+)
+
+SEARCH_HANDLE_TTL = 60 * 60
+# A search returns the best EXACT_MATCHES exact matches, then the best
+# CLOSE_MATCHES close ones, then the others, by pages of up to MAX_PAGE_SIZE
+EXACT_MATCHES, CLOSE_MATCHES = 10, 5
+PAGE_SIZE, MAX_PAGE_SIZE = EXACT_MATCHES + CLOSE_MATCHES, 50
+MAX_RESULTS = 200
 
 ignored_words = [
     "atmosphere",
@@ -18,7 +38,142 @@ ignored_words = [
 ]
 
 
-def fetch_images(keyword: str) -> List[ArangoImage]:
+# Finds the images similar to those in `clicked_images` (a list of Image keys),
+# into `similar`. Shared by the queries that declare `clicked_images`.
+COMMON_MATCHES_AQL = """
+      LET commonMatches = (
+        FOR i IN Image                                                      // Iterate through images
+          FILTER i._key IN clicked_images                                   // Filter for images already clicked
+            FOR v, e IN 1..1 OUTBOUND i SimilarTo                           // For each visited image, fetch its precomputed neighbours
+              FILTER v._key NOT IN clicked_images                           // Filter for images not already clicked
+              COLLECT img = v AGGREGATE weight = SUM(e._score)              // Collect all neighbours (i.e Images), sum their similarity
+              SORT weight DESC
+              LIMIT 6
+              RETURN img                                                    // Return the top 6
+      )
+"""
+LOCATION_MATCHES_AQL = """
+      // (This is still a Work in Progress)
+      LET localizationMatches = (
+        FOR i IN Image                                                      // Iterate through images
+          FILTER i._key IN clicked_images                                   // Filter for clicked images
+          FOR v1, e1 IN 1..1 INBOUND i TagOf                                // For each image, traverse its Tag vertices
+              FILTER v1.tag NOT IN ['Person', 'Building', 'Lighting']       // Filter out "vague" tags
+              FILTER e1._type == 'object' AND e1._score > 0.75              // Filter for confident 'object' relationships
+              FOR v2, e2 IN 1..1 OUTBOUND v1 TagOf                          // For each Tag vertice, traverse its vertices (images)
+                FILTER v2._key NOT IN clicked_images
+                FILTER e2._type == 'object' AND e2._score > 0.80            // Filter for new confident 'object' relationships
+                FILTER GEO_INTERSECTS(GEO_LINESTRING(e1._coord), GEO_LINESTRING(e2._coord)) // Filter for object coordinate intersection
+                SORT e2._score DESC                                         // Sort by confidence score
+                LIMIT 4
+                RETURN DISTINCT v2                                          // Return the top 2
+      )
+      LET landmarkMatches = (
+        FOR i IN Image                                                      // Iterate through images
+          FILTER i._key IN clicked_images                                   // Filter for clicked images
+          FOR v1, e1 IN 1..1 INBOUND i TagOf                                // For each image, traverse its Tag vertices
+            FILTER e1._type == 'landmark' AND e1._location != null          // Filter for 'landmark' relationships
+            SORT e1._score DESC
+            FOR e2 IN TagOf                                                 // Radius lookup on the TagOf geo index
+              FILTER GEO_DISTANCE(e1._location, e2._location) < 1000        // Filter for landmarks within 1km
+              FILTER e2._to != i._id
+              LET i2 = DOCUMENT(e2._to)
+              FILTER i2._key NOT IN clicked_images                          // Filter for images not prev. clicked
+              SORT GEO_DISTANCE(e1._location, e2._location)
+              RETURN DISTINCT i2                                            // Return all images within 1km
+      )
+      LET similar = APPEND(landmarkMatches, APPEND(localizationMatches, commonMatches), true)
+"""
+DISCOVERY_AQL = COMMON_MATCHES_AQL + LOCATION_MATCHES_AQL
+
+
+def fetch_images(
+    keyword: str, limit: int = PAGE_SIZE, offset: int = 0
+) -> ArangoSearchResult:
+    """Returns a page of the images matching a keyword, along with a search
+    handle to visualize them with (see fetch_search_visualization), and a
+    cursor to the next page, if any (see parse_cursor)."""
+    keyword = normalize_keyword(keyword)
+    generation = dataset_generation()
+    page = fetch_page(keyword, generation, limit, offset)
+    return {**page, "handle": search_handle(keyword, generation)}
+
+
+def fetch_page(
+    keyword: str, generation: int, limit: int, offset: int
+) -> ArangoSearchPage:
+    """Concurrent searches for the same page share one query."""
+    keyword = normalize_keyword(keyword)
+    if profiled():
+        return search_page(keyword, generation, limit, offset)
+
+    return flights.do(
+        "fetch_images",
+        (generation, keyword, limit, offset),
+        lambda: search_page(keyword, generation, limit, offset),
+    )
+
+
+def search_page(
+    keyword: str, generation: int, limit: int, offset: int
+) -> ArangoSearchPage:
+    # Later pages are sliced from the ranking of the first one, kept in result_cache
+    ranked = search(keyword, generation)["ranked"]
+    cursor = None
+    if offset + limit < len(ranked):
+        cursor = encode_cursor(keyword, generation, offset + limit)
+
+    return {
+        "images": fetch_images_by_key(ranked[offset : offset + limit]),
+        "cursor": cursor,
+    }
+
+
+def search_handle(keyword: str, generation: int) -> str:
+    """Returns the handle of a search, valid for at least SEARCH_HANDLE_TTL / 2.
+    The handle is only written again once half its lifetime is over."""
+    keyword = normalize_keyword(keyword)
+    handle = hashlib.sha256(f"{generation}:{keyword}".encode()).hexdigest()[:16]
+    result_cache.refresh(
+        "search_handle", handle, generation, keyword, SEARCH_HANDLE_TTL
+    )
+    return handle
+
+
+def encode_cursor(keyword: str, generation: int, offset: int) -> str:
+    data = json.dumps([keyword, generation, offset]).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def parse_cursor(cursor: str) -> Optional[Tuple[str, int, int]]:
+    """Returns the keyword, dataset generation & offset of a page, or None
+    if the cursor is invalid."""
+    try:
+        data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        keyword, generation, offset = json.loads(data)
+    except (ValueError, TypeError):
+        return None
+
+    if not isinstance(keyword, str) or not isinstance(generation, int):
+        return None
+    if not isinstance(offset, int) or offset < 0:
+        return None
+
+    return keyword, generation, offset
+
+
+def search(keyword: str, generation: int) -> ArangoSearch:
+    """Ranks up to MAX_RESULTS images matching a keyword, by key."""
+    if memory is not None:
+        matches = memory.search(keyword, MAX_RESULTS)
+        return {"ranked": rank_matches(matches), "matches": matches["matches"]}
+
+    cached = (
+        None if profiled() else result_cache.get("ranked_search", keyword, generation)
+    )
+    if cached is not None:
+        return cached
+
     aql = """
       WITH Image, Author, Tag, BestGuess                          // Import Required Collections
       LET normTokens = TOKENS(@keyword, 'norm_accent_lower')[0]   // Tokenize user input for exact matching
@@ -32,10 +187,10 @@ def fetch_images(keyword: str) -> List[ArangoImage]:
           , 'norm_accent_lower')
           FOR v, e IN 1..1 OUTBOUND doc AuthorOf, TagOf, BestGuessOf OPTIONS {bfs: true, uniqueVertices: 'global' } // For each View document found, perform a Graph Traversal
             SORT e._score DESC
-            LIMIT 10
-            RETURN DISTINCT v                                       // Return the images with the highest confidence scores
+            LIMIT @max_results
+            RETURN v._key                                           // Return the images by confidence score
       )
-      LET closeMatches = (
+      LET closeDocs = (
         FOR doc IN searchview                                       // Iterate through View documents
           SEARCH ANALYZER(                                          // Search with the text_en analyzer
             BOOST(doc.bestGuess IN textTokens, 2) ||                // Boost by 2 if match is a bestGuess
@@ -43,25 +198,96 @@ def fetch_images(keyword: str) -> List[ArangoImage]:
             BOOST(doc.author IN textTokens, 4)                      // Boost by 4 if match is an Author
           , 'text_en') 
           SORT BM25(doc, 2.4, 1) DESC                               // Sort by BM25 Ranking Function
-          FOR v, e IN 1..1 OUTBOUND doc AuthorOf, TagOf, BestGuessOf OPTIONS {bfs: true, uniqueVertices: 'global' } // For each View document, perform a Graph Traversal
-            FILTER v NOT IN exactMatches                            // Skip images already found
-            SORT  e._score DESC                                     // Sort results by confidence score
-            COLLECT img = v WITH COUNT INTO num                     // Collect all vertices (i.e Images), count their number of occurences
+          RETURN doc
+      )
+      LET closeMatches = (
+        FOR doc IN closeDocs                                        // Iterate through the ranked View documents
+          FOR v IN 1..1 OUTBOUND doc AuthorOf, TagOf, BestGuessOf OPTIONS {bfs: true, uniqueVertices: 'global' } // For each View document, perform a Graph Traversal
+            COLLECT key = v._key WITH COUNT INTO num                // Collect all vertices (i.e Images), count their number of occurences
             SORT num DESC
-            LIMIT 5
-            RETURN img                                              // Return the top 5
+            LIMIT @max_results
+            RETURN key                                              // Return the images by number of occurences
       )
-      RETURN APPEND(exactMatches, closeMatches)
+      RETURN {
+        exact: exactMatches,
+        close: closeMatches,
+        matches: closeDocs[*]._id                                   // Keep the matched vertices for visualizations
+      }
     """
 
-    bind_vars = {"keyword": keyword}
+    bind_vars = {"keyword": keyword, "max_results": MAX_RESULTS}
+
+    matches: ArangoSearchMatches = arango.query(
+        aql, bind_vars=bind_vars, name="fetch_images"
+    ).next()
+    result: ArangoSearch = {
+        "ranked": rank_matches(matches),
+        "matches": matches["matches"],
+    }
+    if not profiled():
+        result_cache.set("ranked_search", keyword, generation, result)
+    return result
+
+
+def rank_matches(matches: ArangoSearchMatches) -> List[str]:
+    """Orders the exact & close matches of a search, see EXACT_MATCHES."""
+    exact = list(dict.fromkeys(matches["exact"][:EXACT_MATCHES]))
+    close = [key for key in matches["close"] if key not in exact]
+    ranked = exact + close[:CLOSE_MATCHES] + matches["exact"] + close
+    return list(dict.fromkeys(ranked))[:MAX_RESULTS]
+
 
-    result = arango.query(aql, bind_vars=bind_vars).next()
+def fetch_images_by_key(image_keys: List[str]) -> List[ArangoImage]:
+    if not image_keys:
+        return []
+    if memory is not None:
+        return memory.images(image_keys)
+
+    aql = "RETURN DOCUMENT('Image', @image_keys)"
+    bind_vars = {"image_keys": image_keys}
+
+    result = arango.query(aql, bind_vars=bind_vars, name="fetch_images_page").next()
     return result
 
 
+def fetch_suggestions(prefix: str, k: int) -> List[Suggestion]:
+    """Returns the `k` most used names starting with `prefix` (see SuggestIndex)."""
+    refresh_suggestions()
+    return suggest_index.suggest(prefix, k)
+
+
+def refresh_suggestions() -> None:
+    suggest_index.refresh(dataset_generation(), load_suggestions)
+
+
+def load_suggestions() -> Iterable[Suggestion]:
+    if memory is not None:
+        return memory.suggestions()
+
+    aql = """
+      FOR e IN @@edges
+        COLLECT vertex = e._from AGGREGATE count = COUNT_DISTINCT(e._to)    // Count the images of each vertex
+        RETURN {name: DOCUMENT(vertex)[@field], type: @field, count}
+    """
+
+    suggestions = []
+    for edges, field in [
+        ("TagOf", "tag"),
+        ("AuthorOf", "author"),
+        ("BestGuessOf", "bestGuess"),
+    ]:
+        bind_vars = {"@edges": edges, "field": field}
+        result = arango.query(aql, bind_vars=bind_vars, name="load_suggestions")
+        suggestions.extend(s for s in result if isinstance(s["name"], str))
+
+    return suggestions
+
+
 def fetch_surprise_tags() -> str:
     max_results = math.floor(random.random() * 3) + 1
+    if memory is not None:
+        return memory.surprise_tags(max_results, ignored_words)
+
     aql = """
       With Tag
       FOR i IN Image
@@ -77,100 +303,105 @@ def fetch_surprise_tags() -> str:
 
     bind_vars = {"max_results": max_results, "ignored_words": ignored_words}
 
-    result = arango.query(aql, bind_vars=bind_vars)
+    result = arango.query(aql, bind_vars=bind_vars, name="fetch_surprise_tags")
     return " ".join([tag for tag in result])
 
 
-def fetch_image_info(img_id: str) -> ArangoImageInfo:
-    aql = """
-      WITH Image, Author, Tag, BestGuess 
-      LET image = FIRST(FOR i IN Image FILTER i._key == @id RETURN i) 
-      LET bestGuess = (FOR v IN 1..1 INBOUND image BestGuessOf RETURN v.bestGuess) 
-      LET tags = (FOR v, e IN 1..1 INBOUND image TagOf SORT e._score DESC RETURN {_id: v._id, tag: v.tag, score: e._score}) 
-      RETURN {image, bestGuess, tags}
+def fetch_image_info(img_id: str) -> Optional[ArangoImageInfo]:
+    return fetch_images_info([img_id]).get(img_id)
+
+
+def fetch_images_info(img_ids: List[str]) -> Dict[str, ArangoImageInfo]:
+    if memory is not None:
+        return memory.images_info(img_ids)
+
+    aql = f"""
+      WITH Image, Author, Tag, BestGuess
+      FOR id IN @ids
+        LET image = DOCUMENT('Image', id)
+        FILTER image != null
+        LET bestGuess = (FOR v IN 1..1 INBOUND image BestGuessOf RETURN v.bestGuess)
+        LET tags = (FOR v, e IN 1..1 INBOUND image TagOf SORT e._score DESC RETURN {{_id: v._id, tag: v.tag, score: e._score}})
+        LET clicked_images = [id]
+        {DISCOVERY_AQL}
+        RETURN {{image, bestGuess, tags, similar}}
     """
 
-    bind_vars = {"id": img_id}
+    bind_vars = {"ids": img_ids}
 
-    result = arango.query(aql, bind_vars=bind_vars).next()
-    result["similar"] = fetch_discovery([img_id])
-    return result
+    result = arango.query(aql, bind_vars=bind_vars, name="fetch_images_info")
+    return {info["image"]["_key"]: info for info in result}
 
 
 def fetch_discovery(clicked_images: List[str]) -> List[ArangoImage]:
-    aql = """
-      WITH Author, Tag, BestGuess                                           // Import collections
-      LET commonMatches = (
-        FOR i IN Image                                                      // Iterate through images
-          FILTER i._key IN @clicked_images                                  // Filter for images already clicked
-            FOR v1, e1 IN 1..1 INBOUND i AuthorOf, TagOf, BestGuessOf       // For each visited image, traverse its vertices (metadata)
-              SORT e1._score DESC                                           // Sort metadata relationships by confidence
-              FOR v2, e2 IN 1..1 OUTBOUND v1 AuthorOf, TagOf, BestGuessOf   // For each metadata vertice, traverse its vertices (images)
-                FILTER v2._key NOT IN @clicked_images                       // Filter for images not already clicked
-                COLLECT img = v2 WITH COUNT INTO num                        // Collect all vertices (i.e Images), count their number of occurences
-                SORT num DESC
-                LIMIT 6
-                RETURN img                                                  // Return the top 6
-      )
-      // (This is still a Work in Progress)
-      LET localizationMatches = (
-        FOR i IN Image                                                      // Iterate through images
-          FILTER i._key IN @clicked_images                                  // Filter for clicked images
-          FOR v1, e1 IN 1..1 INBOUND i TagOf                                // For each image, traverse its Tag vertices
-              FILTER v1.tag NOT IN ['Person', 'Building', 'Lighting']       // Filter out "vague" tags
-              FILTER e1._type == 'object' AND e1._score > 0.75              // Filter for confident 'object' relationships
-              FOR v2, e2 IN 1..1 OUTBOUND v1 TagOf                          // For each Tag vertice, traverse its vertices (images)
-                FILTER v2._key NOT IN @clicked_images
-                FILTER e2._type == 'object' AND e2._score > 0.80            // Filter for new confident 'object' relationships
-                FILTER GEO_INTERSECTS(GEO_LINESTRING(e1._coord), GEO_LINESTRING(e2._coord)) // Filter for object coordinate intersection
-                SORT e2._score DESC                                         // Sort by confidence score
-                LIMIT 4
-                RETURN DISTINCT v2                                          // Return the top 2
-      )
-      LET landmarkMatches = (
-        FOR i IN Image                                                      // Iterate through images
-          FILTER i._key IN @clicked_images                                  // Filter for clicked images
-          FOR v1, e1 IN 1..1 INBOUND i TagOf                                // For each image, traverse its Tag vertices
-            FILTER e1._type == 'landmark'                                   // Filter for 'landmark' relationships
-            SORT e1._score DESC
-            FOR i2 IN Image                                                        // Iterate through images (again)
-              FILTER i2._key != i._key                                             // Filter for images not prev. clicked
-              FOR v2, e2 IN 1..1 INBOUND i2 TagOf                                  // For each non-clicked image, traverse its Tag vertices
-                  FILTER e2._type == 'landmark' AND v2._key NOT IN @clicked_images // Filter for new 'landmark' relationships
-                  LET dist = DISTANCE(e1._latitude, e1._longitude, e2._latitude, e2._longitude) // Calculate distance between landmark metadata
-                  FILTER dist < 1000
-                  SORT dist
-                  RETURN DISTINCT i2                                        // Return all images within 1km
-      )
-      RETURN APPEND(landmarkMatches, APPEND(localizationMatches, commonMatches), true)
-    """
+    """Concurrent discoveries for the same images, in any order, share one query."""
+    clicked_images = sorted(set(clicked_images))
+    if profiled():
+        return discover(clicked_images)
+
+    return flights.do(
+        "fetch_discovery",
+        (dataset_generation(), tuple(clicked_images)),
+        lambda: discover(clicked_images),
+    )
 
+
+def discover(clicked_images: List[str]) -> List[ArangoImage]:
     bind_vars = {"clicked_images": clicked_images}
 
-    result = arango.query(aql, bind_vars=bind_vars).next()
+    common_matches = COMMON_MATCHES_AQL
+    if discovery is not None:
+        common_matches = "LET commonMatches = DOCUMENT('Image', @common_matches)"
+        bind_vars["common_matches"] = discovery.recommend(clicked_images, 6)
+
+    aql = f"""
+      WITH Author, Tag, BestGuess                                           // Import collections
+      LET clicked_images = @clicked_images
+      {common_matches}
+      {LOCATION_MATCHES_AQL}
+      RETURN similar
+    """
+
+    result = arango.query(aql, bind_vars=bind_vars, name="fetch_discovery").next()
     return result
 
 
-def fetch_search_visualization(
-    keyword: str, image_results: List[ArangoImage]
-) -> VisualizationData:
+def fetch_nearby(lat: float, lng: float, radius: float) -> List[ArangoImage]:
+    aql = """
+      WITH Image
+      FOR e IN TagOf                                                        // Radius lookup on the TagOf geo index
+        FILTER GEO_DISTANCE(@point, e._location) <= @radius
+        COLLECT img = e._to AGGREGATE dist = MIN(GEO_DISTANCE(@point, e._location))
+        SORT dist
+        LIMIT 20
+        RETURN DOCUMENT(img)                                                // Return the 20 closest images
+    """
+
+    bind_vars = {
+        "point": {"type": "Point", "coordinates": [lng, lat]},
+        "radius": radius,
+    }
+
+    result = arango.query(aql, bind_vars=bind_vars, name="fetch_nearby")
+    return [image for image in result]
+
+
+def fetch_search_visualization(handle: str) -> Optional[VisualizationData]:
+    """Returns the graph of a search, from the handle returned by fetch_images.
+    Returns None if the handle expired."""
+    generation = dataset_generation()
+    keyword = result_cache.get("search_handle", handle, generation)
+    if keyword is None:
+        return None
+
+    result = search(keyword, generation)
 
     aql = """
       WITH Image, Author, Tag, BestGuess
-      LET textTokens = TOKENS(@keyword, 'text_en_stopwords')
-      LET matchList = (
-        FOR doc IN searchview
-          SEARCH ANALYZER(
-            BOOST(doc.tag IN textTokens, 2) ||
-            BOOST(doc.bestGuess IN textTokens, 3) ||
-            BOOST(doc.author IN textTokens, 4)
-          , 'text_en')
-          RETURN doc
-      )
       LET vertices = (
-        FOR i IN @image_results
-          FOR v, e IN 1..1 INBOUND i._id AuthorOf, TagOf, BestGuessOf OPTIONS {bfs: true, uniqueVertices: 'global' }
-            FILTER v IN matchList
+        FOR key IN @image_keys
+          FOR v, e IN 1..1 INBOUND CONCAT('Image/', key) AuthorOf, TagOf, BestGuessOf OPTIONS {bfs: true, uniqueVertices: 'global' }
+            FILTER v._id IN @matches
             LET vertice = {
               _key: v._key,
               _id: v._id,
@@ -180,66 +411,85 @@ def fetch_search_visualization(
             RETURN DISTINCT vertice
       )
       LET connections = (
-        FOR i IN @image_results
-          LET edges = (FOR v, e IN 1..1 INBOUND i._id AuthorOf, TagOf, BestGuessOf RETURN e)
+        FOR key IN @image_keys
+          LET i = DOCUMENT('Image', key)
+          LET edges = (FOR v, e IN 1..1 INBOUND i AuthorOf, TagOf, BestGuessOf RETURN e)
           RETURN {i, edges}
       )
       RETURN {vertices, connections}
     """
 
-    bind_vars = {"keyword": keyword, "image_results": image_results}
+    bind_vars = {
+        "image_keys": result["ranked"][:PAGE_SIZE],
+        "matches": result["matches"],
+    }
 
-    result = arango.query(aql, bind_vars=bind_vars).next()
+    result = arango.query(
+        aql, bind_vars=bind_vars, name="fetch_search_visualization"
+    ).next()
     return result
 
 
 def fetch_image_visualization(clicked_images: List[str]) -> VisualizationData:
-    similar_images = fetch_discovery(clicked_images)
-
-    aql = """
+    aql = f"""
       WITH Image, Author, Tag, BestGuess
+      LET clicked_images = @clicked_images
+      {DISCOVERY_AQL}
+      LET clicked = (                                                       // Traverse each clicked image once
+        FOR key IN clicked_images
+          LET i = DOCUMENT('Image', key)
+          FILTER i != null
+          LET neighbours = (FOR v, e IN 1..1 INBOUND i AuthorOf, TagOf, BestGuessOf RETURN {{v, e}})
+          RETURN {{i, neighbours}}
+      )
       LET startEdges = (
-        FOR i IN Image
-          FILTER i._key IN @clicked_images
-          LET edges = (FOR v, e IN 1..1 INBOUND i._id AuthorOf, TagOf, BestGuessOf RETURN e)
-          RETURN {
-            i : {
-              _id: i._id,
-              _key: i._key,
-              author: i.author,
-              url: i.url,
+        FOR c IN clicked
+          RETURN {{
+            i : {{
+              _id: c.i._id,
+              _key: c.i._key,
+              author: c.i.author,
+              url: c.i.url,
               color: '#FF36AB',
-            },
-            edges
-          }
+            }},
+            edges: c.neighbours[*].e
+          }}
       )
       LET vertices = (
-        FOR i IN Image
-          FILTER i._key IN @clicked_images
-          FOR v, e IN 1..1 INBOUND i AuthorOf, TagOf, BestGuessOf OPTIONS {bfs: true, uniqueVertices: 'global' }
-            LET vertice = {
-              _key: v._key,
-              _id: v._id,
-              data: v.author OR v.tag OR v.bestGuess,
-              color: v.author ? '#E9D758' : (v.tag ? '#297373' : '#FF8552')
-            }
+        FOR c IN clicked
+          FOR n IN c.neighbours
+            LET vertice = {{
+              _key: n.v._key,
+              _id: n.v._id,
+              data: n.v.author OR n.v.tag OR n.v.bestGuess,
+              color: n.v.author ? '#E9D758' : (n.v.tag ? '#297373' : '#FF8552')
+            }}
             RETURN DISTINCT vertice
       )
       LET endEdges = (
-        FOR i IN @similar_images
-          LET edges = (FOR v, e IN 1..1 INBOUND i._id AuthorOf, TagOf, BestGuessOf RETURN e)
-          RETURN {i, edges}
+        FOR i IN similar
+          LET edges = (FOR v, e IN 1..1 INBOUND i AuthorOf, TagOf, BestGuessOf RETURN e)
+          RETURN {{i, edges}}
       )
-      RETURN {vertices, connections: APPEND(startEdges, endEdges)}
+      RETURN {{vertices, connections: APPEND(startEdges, endEdges)}}
     """
 
-    bind_vars = {"clicked_images": clicked_images, "similar_images": similar_images}
+    bind_vars = {"clicked_images": clicked_images}
 
-    result = arango.query(aql, bind_vars=bind_vars).next()
+    result = arango.query(
+        aql, bind_vars=bind_vars, name="fetch_image_visualization"
+    ).next()
     return result
 
 
 def fetch_db_metrics() -> Dict[str, int]:
+    generation = arango.generation()
+    cached = (
+        None if profiled() else result_cache.get("db_metrics", "counts", generation)
+    )
+    if cached is not None:
+        return cached
+
     aql = """
       RETURN {
         images: LENGTH(Image),
@@ -250,5 +500,22 @@ def fetch_db_metrics() -> Dict[str, int]:
       }
     """
 
-    result = arango.query(aql).next()
+    result = arango.query(aql, name="fetch_db_metrics").next()
+    if not profiled():
+        result_cache.set("db_metrics", "counts", generation, result)
     return result
+
+
+def dataset_generation() -> int:
+    return memory.generation if memory is not None else arango.generation()
+
+
+def profiled() -> bool:
+    """Whether the request profiles its queries (?debug=1). They must then all
+    run: none is answered from result_cache, or by another request's flight."""
+    return query_debug.get() is not None
+
+
+def normalize_keyword(keyword: str) -> str:
+    # The search analyzers are case insensitive, and tokenize on whitespace
+    return " ".join(keyword.lower().split())
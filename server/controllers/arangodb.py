@@ -1,10 +1,46 @@
+import itertools
+import json
 import logging
-from typing import Any, Dict, Sequence
+import math
+import os
+import threading
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
 
 from arango import ArangoClient
 from arango.cursor import Cursor
+from arango.database import StandardDatabase
+from arango.exceptions import ArangoError
+from arango.http import DefaultHTTPClient
 from arango.result import Result
 from arango.typings import Json
+from requests import Session
+from urllib3.util.retry import Retry
+
+from server.controllers.http import HTTPPool
+from server.controllers.metrics import Metrics
+
+# Collects the profile & plan of every query run while set (see ArangoDriver.query)
+query_debug: ContextVar[Optional[List[Json]]] = ContextVar("query_debug", default=None)
+
+
+class PooledClient(DefaultHTTPClient):
+    """python-arango's HTTP client, with the sessions & timeouts of a HTTPPool."""
+
+    def __init__(self, pool: HTTPPool) -> None:
+        self.pool = pool
+        self.REQUEST_TIMEOUT = pool.timeout
+
+    def create_session(self, host: str) -> Session:
+        retry = Retry(
+            total=self.RETRY_ATTEMPTS,
+            backoff_factor=self.BACKOFF_FACTOR,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["HEAD", "GET", "OPTIONS"],
+        )
+        return self.pool.create_session(retry)
 
 
 class ArangoDriver:
@@ -28,22 +64,153 @@ class ArangoDriver:
         },
     ]
 
-    def __init__(self, url: str, user: str, password: str, db_name: str):
-        client = ArangoClient(hosts=url)
-        self.db = client.db(db_name, username=user, password=password)
-        logging.info(f"Arango: {self.db.name} database")
+    META_COLLECTION = "Meta"
+    SIMILARITY_COLLECTION = "SimilarTo"
+    SIMILARITY_TOP_K = 12
+
+    def __init__(
+        self,
+        url: str,
+        user: str,
+        password: str,
+        db_name: str,
+        generation_poll: float = 1.0,
+        metrics: Optional[Metrics] = None,
+        slow_query_ms: float = 500.0,
+        pool: Optional[HTTPPool] = None,
+    ):
+        self.url = url
+        self.credentials = (db_name, user, password)
+        self.pool = pool or HTTPPool()
+        self.local_db: Optional[StandardDatabase] = None
+        self.local_pid: Optional[int] = None
+        self.metrics = metrics
+        self.slow_query_ms = slow_query_ms
+        self.generation_poll = generation_poll
+        self.generation_cache = (0, -math.inf)  # (generation, fetched at)
+        logging.info(f"Arango: {db_name} database")
+
+    @property
+    def db(self) -> StandardDatabase:
+        """The database of this process, connected on first use (see HTTPPool)."""
+        if self.local_db is None or self.local_pid != os.getpid():
+            db_name, user, password = self.credentials
+            client = ArangoClient(hosts=self.url, http_client=PooledClient(self.pool))
+            self.local_db = client.db(db_name, username=user, password=password)
+            self.local_pid = os.getpid()
 
-    def query(self, aql: str, bind_vars: Dict[str, Any] = None) -> Result[Cursor]:
-        return self.db.aql.execute(aql, bind_vars=bind_vars)
+        return self.local_db
+
+    def query(
+        self,
+        aql: str,
+        bind_vars: Dict[str, Any] = None,
+        name: str = "unnamed",
+        **options,
+    ) -> Result[Cursor]:
+        """Runs a named query, recording its wall time & execution stats.
+        `options` are passed on to AQL.execute (e.g. batch_size, stream).
+
+        Queries slower than `slow_query_ms` are logged. While `query_debug` is
+        set, queries are profiled and their plan is appended to it.
+        """
+        debug = query_debug.get()
+        start = time.perf_counter()
+        try:
+            cursor = self.db.aql.execute(
+                aql,
+                bind_vars=bind_vars,
+                profile=True if debug is not None else None,
+                **options,
+            )
+        finally:
+            ms = (time.perf_counter() - start) * 1000
+            if self.metrics:
+                self.metrics.observe("queries", name, ms)
+
+        stats = cursor.statistics() or {}
+        scanned = {
+            "scanned_full": stats.get("scanned_full", 0),
+            "scanned_index": stats.get("scanned_index", 0),
+            "filtered": stats.get("filtered", 0),
+        }
+        if self.metrics:
+            self.metrics.add("query_stats", name, scanned)
+
+        if ms >= self.slow_query_ms:
+            entry = {
+                "query": name,
+                "ms": round(ms, 2),
+                "execution_ms": round(stats.get("execution_time", 0) * 1000, 2),
+                **scanned,
+                "bind_vars": sorted(bind_vars or {}),
+            }
+            logging.warning(f"Slow query: {json.dumps(entry)}")
+
+        if debug is not None:
+            debug.append(
+                {
+                    "query": name,
+                    "ms": round(ms, 2),
+                    "stats": stats,
+                    "profile": cursor.profile(),
+                    "plan": self.explain(aql, bind_vars),
+                }
+            )
+
+        return cursor
+
+    def explain(self, aql: str, bind_vars: Dict[str, Any] = None) -> Json:
+        """Summarizes the optimizer's plan: what each node iterates & with which index."""
+        plan = self.db.aql.explain(aql, bind_vars=bind_vars)
+        nodes = []
+        for node in plan["nodes"]:
+            summary = {"type": node["type"]}
+            if "collection" in node:
+                summary["collection"] = node["collection"]
+            if "view" in node:
+                summary["view"] = node["view"]
+            if "indexes" in node:
+                summary["indexes"] = [
+                    {"type": i["type"], "fields": i["fields"]} for i in node["indexes"]
+                ]
+            nodes.append(summary)
+
+        return {
+            "nodes": nodes,
+            "rules": plan.get("rules", []),
+            "estimated_cost": plan.get("estimatedCost"),
+        }
 
     def create_collection(self, name: str, is_edge_collection: bool = False):
         logging.info(f"Creating {name} collection...")
         self.db.delete_collection(name, ignore_missing=True)
         self.db.create_collection(name, edge=is_edge_collection)
 
-    def restore_collection(self, name: str, data: Sequence[Json]):
+    def restore_collection(
+        self, name: str, data: Iterable[Json], batch_size: int = 5000
+    ) -> int:
+        """Imports documents `batch_size` at a time. Returns the number created.
+
+        Raises:
+            ValueError: When documents are rejected, e.g. duplicates
+        """
         logging.info(f"Restoring {name} collection...")
-        self.db.collection(name).import_bulk(data, on_duplicate="error")
+        collection, count = self.db.collection(name), 0
+        data = iter(data)
+        while True:
+            batch = list(itertools.islice(data, batch_size))
+            if not batch:
+                return count
+
+            result = collection.import_bulk(batch, on_duplicate="error", details=True)
+            count += result["created"]
+            if result["errors"]:
+                details = "; ".join(result.get("details", [])[:5])
+                raise ValueError(
+                    f"{name}: {result['errors']} documents rejected "
+                    f"after {count} were restored ({details})"
+                )
 
     def create_analyzer(self, name: str, type: str, **properties):
         logging.info(f"Creating {name} analyzer...")
@@ -55,11 +222,109 @@ class ArangoDriver:
         self.db.delete_view(name, ignore_missing=True)
         self.db.create_view(name, type, properties)
 
+    def create_geo_index(self, collection: str, field: str):
+        logging.info(f"Creating {collection}.{field} geo index...")
+        # `ordered` is python-arango's name for geoJson: [longitude, latitude]
+        self.db.collection(collection).add_geo_index([field], ordered=True)
+
+    def has_geo_index(self, collection: str, field: str) -> bool:
+        return any(
+            index["type"] == "geo" and index["fields"] == [field]
+            for index in self.db.collection(collection).indexes()
+        )
+
     def create_graph(self, name: str, edge_definitions: list):
         logging.info(f"Creating {name} graph...")
         self.db.delete_graph(name, ignore_missing=True)
         self.db.create_graph(name, edge_definitions=edge_definitions)
 
+    def backfill_landmark_locations(self):
+        """Adds the geo indexed _location point to landmark edges that only
+        carry the older _latitude/_longitude attributes."""
+        # Databases onboarded before the geo index existed lack it
+        if not self.has_geo_index("TagOf", "_location"):
+            self.create_geo_index("TagOf", "_location")
+
+        logging.info("Backfilling landmark locations...")
+        aql = """
+            FOR e IN TagOf
+                FILTER e._type == 'landmark' AND e._location == null
+                FILTER e._latitude != null AND e._longitude != null
+                UPDATE e WITH { _location: GEO_POINT(e._longitude, e._latitude) } IN TagOf
+        """
+        self.query(aql)
+
+    def refresh_similarity(self, image_keys: Sequence[str] = None):
+        """(Re)computes the SimilarTo edges of images: their top-K neighbours
+        by co-occurrence, weighted by the scores of both shared relationships.
+
+        Recomputes every image when `image_keys` is None.
+        """
+        # Databases onboarded before SimilarTo existed lack the collection
+        if not self.db.has_collection(self.SIMILARITY_COLLECTION):
+            self.db.create_collection(self.SIMILARITY_COLLECTION, edge=True)
+
+        if image_keys is None:
+            image_keys = list(self.query("FOR i IN Image RETURN i._key"))
+
+        logging.info(f"Computing similar images of {len(image_keys)} images...")
+        remove_aql = """
+            FOR e IN @@similar_to
+                FILTER e._from IN @image_ids
+                REMOVE e IN @@similar_to
+        """
+        insert_aql = """
+            WITH Image, Author, Tag, BestGuess
+            FOR i IN Image
+                FILTER i._key IN @image_keys
+                FOR n IN (
+                    FOR v1, e1 IN 1..1 INBOUND i AuthorOf, TagOf, BestGuessOf
+                        FOR v2, e2 IN 1..1 OUTBOUND v1 AuthorOf, TagOf, BestGuessOf
+                            FILTER v2._id != i._id
+                            COLLECT img = v2 AGGREGATE weight = SUM(e1._score * e2._score)
+                            SORT weight DESC
+                            LIMIT @k
+                            RETURN {img, weight}
+                )
+                INSERT {
+                    _key: CONCAT(i._key, '-', n.img._key),
+                    _from: i._id,
+                    _to: n.img._id,
+                    _score: n.weight
+                } INTO @@similar_to OPTIONS { overwriteMode: 'replace' }
+        """
+
+        for i in range(0, len(image_keys), 500):
+            keys = image_keys[i : i + 500]
+            bind_vars = {"@similar_to": self.SIMILARITY_COLLECTION}
+            self.query(
+                remove_aql, {**bind_vars, "image_ids": [f"Image/{k}" for k in keys]}
+            )
+            self.query(
+                insert_aql,
+                {**bind_vars, "image_keys": keys, "k": self.SIMILARITY_TOP_K},
+            )
+
+    def update_similarity(self, new_image_keys: Sequence[str]):
+        """Computes the SimilarTo edges of new images, then refreshes those of
+        their neighbours, which are the images most likely to now rank them."""
+        if not new_image_keys:
+            return
+
+        self.refresh_similarity(new_image_keys)
+        aql = """
+            FOR e IN @@similar_to
+                FILTER e._from IN @image_ids
+                FILTER PARSE_IDENTIFIER(e._to).key NOT IN @image_keys
+                RETURN DISTINCT PARSE_IDENTIFIER(e._to).key
+        """
+        bind_vars = {
+            "@similar_to": self.SIMILARITY_COLLECTION,
+            "image_ids": [f"Image/{k}" for k in new_image_keys],
+            "image_keys": list(new_image_keys),
+        }
+        self.refresh_similarity(list(self.query(aql, bind_vars)))
+
     def nuke_database(self):
         logging.info("ALERT: Nuking database...")
         io = input("\nAre you sure? (y/yes/shutup): ")
@@ -94,6 +359,48 @@ class ArangoDriver:
         new_doc = collection.insert(document, sync=True, return_new=True)
         return new_doc["new"], False
 
+    def generation(self) -> int:
+        """Returns the dataset generation, bumped by every script altering the
+        catalog. Polled at most once every `generation_poll` seconds."""
+        generation, fetched_at = self.generation_cache
+        if time.monotonic() - fetched_at < self.generation_poll:
+            return generation
+
+        aql = "RETURN DOCUMENT(@@meta, 'dataset').generation"
+        try:
+            bind_vars = {"@meta": self.META_COLLECTION}
+            generation = self.query(aql, bind_vars, name="generation").next() or 0
+        except ArangoError:
+            generation = 0  # Meta collection is missing, i.e a nuked database
+
+        self.generation_cache = (generation, time.monotonic())
+        return generation
+
+    def bump_generation(self) -> int:
+        if not self.db.has_collection(self.META_COLLECTION):
+            self.db.create_collection(self.META_COLLECTION)
+
+        # Never lower than the clock, so that a nuked & re-onboarded database
+        # does not hand out generations that caches have already seen
+        aql = """
+            UPSERT { _key: 'dataset' }
+            INSERT { _key: 'dataset', generation: DATE_NOW() }
+            UPDATE { generation: MAX([OLD.generation + 1, DATE_NOW()]) } IN @@meta
+            RETURN NEW.generation
+        """
+        generation = self.query(aql, {"@meta": self.META_COLLECTION}).next()
+        self.generation_cache = (generation, time.monotonic())
+        logging.info(f"Arango: dataset generation {generation}")
+        return generation
+
+    def existing_keys(self, doc_collection: str, keys: Sequence[str]) -> Set[str]:
+        aql = "FOR doc IN @@collection FILTER doc._key IN @keys RETURN doc._key"
+        bind_vars = {"@collection": doc_collection, "keys": list(keys)}
+        return set(self.query(aql, bind_vars))
+
+    def bulk_writer(self, batch_size: int = 5000, flush_interval: float = 5.0):
+        return BulkWriter(self.db, batch_size, flush_interval)
+
     def dissolve(self, image_id: str):
         logging.info(f"Dissolving: {image_id}...")
         aql = """
@@ -106,3 +413,112 @@ class ArangoDriver:
 
         self.query(aql, bind_vars)
         self.db.collection("Image").delete(image_id)
+
+
+class BulkWriter:
+    """Buffers vertex & edge documents per collection, and imports them with
+    `import_bulk(on_duplicate="ignore")` once `batch_size` documents are
+    buffered or `flush_interval` seconds have passed since the last flush.
+
+    Like ArangoDriver.insert, the first document written for a _key wins.
+    The time threshold is checked on insert, so call flush() (or use the
+    writer as a context manager) once done. Safe to share between threads.
+    """
+
+    def __init__(self, db, batch_size: int, flush_interval: float):
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffers: Dict[str, Dict[str, Json]] = defaultdict(dict)
+        self.buffered = 0
+        self.last_flush = time.monotonic()
+        self.totals: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.lock = threading.RLock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.flush()
+
+    def insert(self, doc_collection: str, **document) -> Json:
+        if "_key" not in document:
+            raise KeyError("Missing _key")
+
+        document["_id"] = f'{doc_collection}/{document["_key"]}'
+        self.insert_many([(doc_collection, document)])
+        return document
+
+    def insert_many(self, documents: Iterable[Tuple[str, Json]]) -> None:
+        with self.lock:
+            for doc_collection, document in documents:
+                buffer = self.buffers[doc_collection]
+                if document["_key"] not in buffer:
+                    buffer[document["_key"]] = document
+                    self.buffered += 1
+
+            is_full = self.buffered >= self.batch_size
+            is_stale = time.monotonic() - self.last_flush >= self.flush_interval
+            if is_full or is_stale:
+                self.flush()
+
+    def stage(self) -> "StagedWrites":
+        return StagedWrites(self)
+
+    def flush(self) -> Dict[str, Dict[str, int]]:
+        """Imports every buffered document.
+
+        Returns:
+            The created/ignored/errors counts of this batch, per collection
+        """
+        with self.lock:
+            counts: Dict[str, Dict[str, int]] = {}
+            for doc_collection, buffer in self.buffers.items():
+                if not buffer:
+                    continue
+
+                documents = [
+                    {k: v for k, v in doc.items() if k != "_id"}
+                    for doc in buffer.values()
+                ]
+                result = self.db.collection(doc_collection).import_bulk(
+                    documents,
+                    halt_on_error=False,
+                    details=False,
+                    on_duplicate="ignore",
+                )
+                counts[doc_collection] = {
+                    "created": result["created"],
+                    "ignored": result["ignored"],
+                    "errors": result["errors"],
+                }
+                for count, value in counts[doc_collection].items():
+                    self.totals[doc_collection][count] += value
+
+                logging.info(f"Bulk: {doc_collection} {counts[doc_collection]}")
+
+            self.buffers.clear()
+            self.buffered = 0
+            self.last_flush = time.monotonic()
+            return counts
+
+
+class StagedWrites:
+    """Collects the documents of one unit of work (e.g an image and its
+    metadata) so that they reach the BulkWriter together, or not at all."""
+
+    def __init__(self, writer: BulkWriter):
+        self.writer = writer
+        self.documents: List[Tuple[str, Json]] = []
+
+    def insert(self, doc_collection: str, **document) -> Json:
+        if "_key" not in document:
+            raise KeyError("Missing _key")
+
+        document["_id"] = f'{doc_collection}/{document["_key"]}'
+        self.documents.append((doc_collection, document))
+        return document
+
+    def commit(self) -> None:
+        self.writer.insert_many(self.documents)
+        self.documents = []
@@ -0,0 +1,113 @@
+import asyncio
+import concurrent.futures
+import os
+import threading
+from typing import Dict, List, Optional, Sequence
+
+import aiohttp
+
+from server.controllers.googlevision import VisionCache, VisionDriver
+from server.controllers.http import HTTPPool
+from server.controllers.singleflight import SingleFlight
+from server.typings import VisionResult
+
+
+class AsyncVisionDriver(VisionDriver):
+    """Sends the Google Vision requests of every thread of a worker through
+    one asyncio loop, running in a background thread.
+
+    At most `concurrency` requests are in flight at once, the others wait
+    their turn, on one shared session. A request not answered within
+    `timeout` seconds (waiting included) is cancelled, and the calling
+    thread gets a TimeoutError. The calling thread still blocks until then:
+    this bounds the Vision calls of a worker, the other threads of its
+    gthread worker keep serving requests.
+    """
+
+    def __init__(
+        self,
+        auth,
+        cache: Optional[VisionCache] = None,
+        pool: Optional[HTTPPool] = None,
+        flights: Optional[SingleFlight] = None,
+        concurrency: int = 8,
+        timeout: float = 30.0,
+    ) -> None:
+        super().__init__(auth, cache, pool, flights)
+        self.ERRORS += (aiohttp.ClientError, asyncio.TimeoutError, TimeoutError)
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.pid: Optional[int] = None
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.semaphore: Optional[asyncio.Semaphore] = None
+        self.counters = {"in_flight": 0, "waiting": 0, "timeouts": 0}
+
+    def event_loop(self) -> asyncio.AbstractEventLoop:
+        """Returns the loop of this process, started on first use (see HTTPPool)."""
+        with self.lock:
+            if self.loop is None or self.pid != os.getpid():
+                self.loop, self.pid = asyncio.new_event_loop(), os.getpid()
+                self.session, self.semaphore = None, None
+                threading.Thread(
+                    target=self.loop.run_forever, name="vision", daemon=True
+                ).start()
+
+            return self.loop
+
+    def annotate(self, image_uris: Sequence[str]) -> List[VisionResult]:
+        future = asyncio.run_coroutine_threadsafe(
+            self.annotate_async(image_uris), self.event_loop()
+        )
+        try:
+            return future.result(self.timeout)
+        except concurrent.futures.TimeoutError:
+            # Aborts the request, or frees its place in line
+            if not future.cancel():
+                return future.result()  # It just completed
+
+            with self.lock:
+                self.counters["timeouts"] += 1
+            raise TimeoutError(f"Google Vision did not answer in {self.timeout}s")
+
+    async def annotate_async(self, image_uris: Sequence[str]) -> List[VisionResult]:
+        if self.session is None:
+            # Created within the loop, which they are bound to
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.pool.pool_size, force_close=not self.pool.keep_alive
+                ),
+                # The total timeout is enforced by annotate, cancelling the task
+                timeout=aiohttp.ClientTimeout(
+                    total=None, sock_connect=self.pool.timeout[0]
+                ),
+                headers=(
+                    {"User-Agent": "picsumvision (gzip)"}
+                    if self.pool.compress
+                    else None
+                ),
+                auto_decompress=True,
+            )
+
+        self.counters["waiting"] += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.counters["waiting"] -= 1
+
+        self.counters["in_flight"] += 1
+        try:
+            async with self.session.post(
+                self.endpoint, json=self.request_body(image_uris)
+            ) as response:
+                response.raise_for_status()
+                return self.parse_responses(image_uris, await response.json())
+        finally:
+            self.counters["in_flight"] -= 1
+            self.semaphore.release()
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.counters)
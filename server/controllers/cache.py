@@ -0,0 +1,148 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+
+class SQLiteStore:
+    """Hands out one SQLite connection per thread & process.
+
+    gunicorn forks its workers after importing the app (--preload), so a
+    connection is never reused across a fork.
+    """
+
+    def __init__(self, path: str, schema: str) -> None:
+        self.path = path
+        self.schema = schema
+        self.local = threading.local()
+
+    def connection(self) -> sqlite3.Connection:
+        conn: Optional[sqlite3.Connection] = getattr(self.local, "conn", None)
+        if conn is None or self.local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")  # Losing a cache write is fine
+            conn.executescript(self.schema)
+            self.local.conn, self.local.pid = conn, os.getpid()
+
+        return conn
+
+
+class ResultCache:
+    """Caches query results in a SQLite file shared by every worker of a host.
+
+    Entries are tagged with the dataset generation they were computed from
+    (see ArangoDriver.generation), and only served for that generation, so
+    invalidation does not rely on TTLs. Stale & expired entries, and past
+    `max_entries` the oldest ones, are evicted by a sweep running at most
+    every `sweep_interval` seconds, after a write.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS results (
+            namespace TEXT NOT NULL,
+            key TEXT NOT NULL,
+            generation INTEGER NOT NULL,
+            value TEXT NOT NULL,
+            expires REAL,
+            created REAL NOT NULL,
+            PRIMARY KEY (namespace, key)
+        );
+        CREATE INDEX IF NOT EXISTS results_created ON results (created);
+        CREATE INDEX IF NOT EXISTS results_generation ON results (generation);
+        CREATE INDEX IF NOT EXISTS results_expires ON results (expires);
+    """
+
+    def __init__(
+        self, path: str, max_entries: int, sweep_interval: float = 60.0
+    ) -> None:
+        self.store = SQLiteStore(path, self.SCHEMA)
+        self.max_entries = max_entries
+        self.sweep_interval = sweep_interval
+        self.last_sweep = time.monotonic()
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0}
+
+    def get(self, namespace: str, key: str, generation: int) -> Optional[Any]:
+        row = (
+            self.store.connection()
+            .execute(
+                """SELECT value FROM results
+                WHERE namespace = ? AND key = ? AND generation = ?
+                AND (expires IS NULL OR expires > ?)""",
+                (namespace, key, generation, time.time()),
+            )
+            .fetchone()
+        )
+
+        self.count("misses" if row is None else "hits")
+        return None if row is None else json.loads(row[0])
+
+    def set(
+        self,
+        namespace: str,
+        key: str,
+        generation: int,
+        value: Any,
+        ttl: Optional[float] = None,
+    ) -> None:
+        now = time.time()
+        expires = now + ttl if ttl else None
+
+        conn = self.store.connection()
+        conn.execute(
+            "REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+            (namespace, key, generation, json.dumps(value), expires, now),
+        )
+        conn.commit()
+
+        if time.monotonic() - self.last_sweep >= self.sweep_interval:
+            self.sweep(generation)
+
+    def refresh(
+        self, namespace: str, key: str, generation: int, value: Any, ttl: float
+    ) -> None:
+        """Sets an entry, unless it is there with more than half its ttl left.
+        Keeps entries alive without a write on every use."""
+        row = (
+            self.store.connection()
+            .execute(
+                """SELECT 1 FROM results
+                WHERE namespace = ? AND key = ? AND generation = ? AND expires > ?""",
+                (namespace, key, generation, time.time() + ttl / 2),
+            )
+            .fetchone()
+        )
+        if row is None:
+            self.set(namespace, key, generation, value, ttl)
+
+    def sweep(self, generation: int) -> None:
+        """Evicts the entries of older generations, expired & past max_entries."""
+        with self.lock:
+            if time.monotonic() - self.last_sweep < self.sweep_interval:
+                return  # Another thread just did
+            self.last_sweep = time.monotonic()
+
+        conn = self.store.connection()
+        conn.execute(
+            "DELETE FROM results WHERE generation < ? OR expires <= ?",
+            (generation, time.time()),
+        )
+        conn.execute(
+            """DELETE FROM results WHERE rowid IN (
+                SELECT rowid FROM results ORDER BY created DESC LIMIT -1 OFFSET ?
+            )""",
+            (self.max_entries,),
+        )
+        conn.commit()
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.counters)
+
+    def count(self, counter: str) -> None:
+        with self.lock:
+            self.counters[counter] += 1
@@ -0,0 +1,83 @@
+import logging
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from server.controllers.arangodb import ArangoDriver
+
+
+class DiscoveryMatrix:
+    """Ranks the images sharing the most (& most confident) Author, Tag and
+    BestGuess vertices with a set of clicked images, in-process.
+
+    Keeps an image×vertex CSR matrix A of the edge scores. The co-occurrence
+    weights of every image are A·(Aᵀx), for x the clicked images, i.e. the
+    SUM(e1._score * e2._score) of ArangoDriver.refresh_similarity. The matrix
+    is rebuilt whenever the dataset generation changes.
+    """
+
+    EDGE_COLLECTIONS = ["AuthorOf", "TagOf", "BestGuessOf"]
+
+    def __init__(self, arango: ArangoDriver) -> None:
+        self.arango = arango
+        self.lock = threading.Lock()
+        self.generation: Optional[int] = None
+        # (matrix, image keys by row, row by image key), swapped in at once
+        self.state = (csr_matrix((0, 0)), [], {})
+
+    def recommend(self, clicked_images: List[str], k: int) -> List[str]:
+        """Returns the keys of the top `k` images for `clicked_images`."""
+        self.refresh(self.arango.generation())
+        matrix, image_keys, image_index = self.state
+
+        rows = [image_index[key] for key in clicked_images if key in image_index]
+        if not rows:
+            return []
+
+        vertex_weights = np.asarray(matrix[rows].sum(axis=0)).ravel()
+        scores = matrix @ vertex_weights
+        scores[rows] = 0
+
+        k = min(k, np.count_nonzero(scores))
+        if k == 0:
+            return []
+
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [image_keys[i] for i in top]
+
+    def refresh(self, generation: int) -> None:
+        if generation == self.generation:
+            return
+
+        with self.lock:
+            if generation == self.generation:
+                return
+
+            aql = "FOR e IN @@collection RETURN [e._to, e._from, e._score]"
+            images: Dict[str, int] = {}
+            vertices: Dict[str, int] = {}
+            rows, cols, scores = [], [], []
+            for collection in self.EDGE_COLLECTIONS:
+                bind_vars = {"@collection": collection}
+                for image_id, vertex_id, score in self.arango.query(
+                    aql, bind_vars=bind_vars, name="discovery_edges"
+                ):
+                    rows.append(images.setdefault(image_id, len(images)))
+                    cols.append(vertices.setdefault(vertex_id, len(vertices)))
+                    scores.append(score or 0)
+
+            matrix = csr_matrix(
+                (np.array(scores, dtype=np.float32), (rows, cols)),
+                shape=(len(images), len(vertices)),
+            )
+            image_keys = [image_id.split("/", 1)[1] for image_id in images]
+            image_index = {key: i for i, key in enumerate(image_keys)}
+            self.state = (matrix, image_keys, image_index)
+            self.generation = generation
+            logging.info(
+                f"Discovery: {len(images)} images × {len(vertices)} vertices, "
+                f"{matrix.nnz} edges (generation {generation})"
+            )
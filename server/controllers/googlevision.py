@@ -1,10 +1,126 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple, Type
+
 import requests
 
+from server.controllers.cache import SQLiteStore
+from server.controllers.http import HTTPPool
+from server.controllers.singleflight import SingleFlight
 from server.typings import VisionResult
 
 
+class VisionCache:
+    """Caches Google Vision responses, keyed by image url & feature set.
+
+    An in-process LRU of `memory_entries` sits in front of a SQLite store
+    shared by every worker. Entries expire after `ttl` seconds, and the least
+    recently used ones are evicted past `max_entries`.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS vision (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            expires REAL NOT NULL,
+            accessed REAL NOT NULL
+        );
+    """
+
+    def __init__(
+        self, path: str, ttl: int, max_entries: int, memory_entries: int = 256
+    ) -> None:
+        self.store = SQLiteStore(path, self.SCHEMA)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+    @staticmethod
+    def key(image_uri: str, features: List[dict]) -> str:
+        data = json.dumps([image_uri, features], sort_keys=True)
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[VisionResult]:
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry and entry[0] > now:
+                self.memory.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                return entry[1]
+
+        conn = self.store.connection()
+        row = conn.execute(
+            "SELECT value, expires FROM vision WHERE key = ? AND expires > ?",
+            (key, now),
+        ).fetchone()
+        if row is None:
+            self.count("misses")
+            return None
+
+        conn.execute("UPDATE vision SET accessed = ? WHERE key = ?", (now, key))
+        conn.commit()
+
+        value: VisionResult = json.loads(row[0])
+        self.remember(key, row[1], value)
+        self.count("disk_hits")
+        return value
+
+    def set(self, key: str, value: VisionResult) -> None:
+        now = time.time()
+        expires = now + self.ttl
+        self.remember(key, expires, value)
+
+        conn = self.store.connection()
+        conn.execute(
+            "REPLACE INTO vision (key, value, expires, accessed) VALUES (?, ?, ?, ?)",
+            (key, json.dumps(value), expires, now),
+        )
+        conn.execute("DELETE FROM vision WHERE expires <= ?", (now,))
+        conn.execute(
+            """DELETE FROM vision WHERE key IN (
+                SELECT key FROM vision ORDER BY accessed DESC LIMIT -1 OFFSET ?
+            )""",
+            (self.max_entries,),
+        )
+        conn.commit()
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {**self.counters, "memory_entries": len(self.memory)}
+
+    def remember(self, key: str, expires: float, value: VisionResult) -> None:
+        with self.lock:
+            self.memory[key] = (expires, value)
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.memory_entries:
+                self.memory.popitem(last=False)
+
+    def count(self, counter: str) -> None:
+        with self.lock:
+            self.counters[counter] += 1
+
+
 class VisionDriver:
-    def __init__(self, auth) -> None:
+    BATCH_SIZE = 16  # images:annotate accepts at most 16 images per request
+    ERRORS: Tuple[Type[Exception], ...] = (requests.RequestException, ValueError)
+
+    def __init__(
+        self,
+        auth,
+        cache: Optional[VisionCache] = None,
+        pool: Optional[HTTPPool] = None,
+        flights: Optional[SingleFlight] = None,
+    ) -> None:
+        self.cache = cache
+        self.pool = pool or HTTPPool()
+        self.flights = flights or SingleFlight()
         self.endpoint = f"https://vision.googleapis.com/v1/images:annotate?key={auth}"
         self.headers = {"Content-Type": "application/json"}
         self.features = [
@@ -12,13 +128,57 @@ class VisionDriver:
             {"maxResults": 100, "type": "WEB_DETECTION"},
             {"maxResults": 100, "type": "OBJECT_LOCALIZATION"},
             {"maxResults": 100, "type": "LANDMARK_DETECTION"},
-            {"maxResults": 100, "type": "IMAGE_PROPERTIES"}
+            {"maxResults": 100, "type": "IMAGE_PROPERTIES"},
             # {"maxResults": 5, "type": "FACE_DETECTION"},
             # {"maxResults": 5, "type": "TEXT_DETECTION"},
         ]
 
     def get_image_metadata(self, image_uri: str) -> VisionResult:
-        body = {
+        if self.cache is None:
+            return self.annotate([image_uri])[0]
+
+        key = self.cache.key(image_uri, self.features)
+        vision_data = self.cache.get(key)
+        if vision_data is None:
+            vision_data = self.annotate([image_uri])[0]
+            if vision_data and "error" not in vision_data:
+                self.cache.set(key, vision_data)
+
+        return vision_data
+
+    def get_image_metadata_batch(
+        self, image_uris: Sequence[str]
+    ) -> Dict[str, VisionResult]:
+        """Returns vision data for many urls, using one request per BATCH_SIZE images.
+
+        A failed image comes back as {"error": ...} without affecting its batch
+        neighbours. A failed HTTP call marks every image of that batch as errored.
+        """
+        results: Dict[str, VisionResult] = {}
+        for i in range(0, len(image_uris), self.BATCH_SIZE):
+            batch = image_uris[i : i + self.BATCH_SIZE]
+            try:
+                responses = self.annotate(batch)
+            except self.ERRORS as e:
+                responses = [{"error": {"code": 0, "message": str(e)}}] * len(batch)
+
+            for image_uri, response in zip(batch, responses):
+                results[image_uri] = response
+
+        return results
+
+    def annotate(self, image_uris: Sequence[str]) -> List[VisionResult]:
+        response = self.pool.session().post(
+            self.endpoint,
+            headers=self.headers,
+            json=self.request_body(image_uris),
+            timeout=self.pool.timeout,
+        )
+        response.raise_for_status()
+        return self.parse_responses(image_uris, response.json())
+
+    def request_body(self, image_uris: Sequence[str]) -> dict:
+        return {
             "requests": [
                 {
                     "features": self.features,
@@ -28,20 +188,33 @@ class VisionDriver:
                         },
                     },
                 }
+                for image_uri in image_uris
             ]
         }
 
-        response = requests.post(self.endpoint, headers=self.headers, json=body)
-        response.raise_for_status()
+    def parse_responses(
+        self, image_uris: Sequence[str], body: dict
+    ) -> List[VisionResult]:
+        responses: List[VisionResult] = body.get("responses", [])
+        if len(responses) != len(image_uris):
+            raise ValueError("Google Vision returned a partial batch")
 
-        return response.json()["responses"][0]
+        return responses
 
     def generate_keyword_from_url(self, url) -> str:
         """Returns vision data in a string for a url. Used for search-by-url feature.
 
+        Concurrent calls for the same url share one Vision request.
+
         Raises:
             ValueError: When no google vision data is found
         """
+        url = url.strip()
+        return self.flights.do(
+            "generate_keyword_from_url", url, lambda: self.keyword_from_url(url)
+        )
+
+    def keyword_from_url(self, url: str) -> str:
         vision_data: dict = self.get_image_metadata(url)
         if not vision_data or "error" in vision_data:
             raise ValueError("Google Vision Uncooperative")
@@ -0,0 +1,86 @@
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class HTTPPool:
+    """Creates the requests sessions of a driver, with a connection pool of
+    `pool_size` per host, default timeouts, keep-alive & response compression.
+
+    Sessions are created lazily in the process that uses them: gunicorn forks
+    its workers after importing the app (--preload), and a session created
+    before the fork would share its sockets between workers.
+    """
+
+    def __init__(
+        self,
+        pool_size: int = 10,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 60.0,
+        keep_alive: bool = True,
+        compress: bool = True,
+    ) -> None:
+        self.pool_size = pool_size
+        self.timeout: Tuple[float, float] = (connect_timeout, read_timeout)
+        self.keep_alive = keep_alive
+        self.compress = compress
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.sessions: List[requests.Session] = []
+        self.local_session: Optional[requests.Session] = None
+
+    def create_session(self, retry: Optional[Retry] = None) -> requests.Session:
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_size,
+            pool_maxsize=self.pool_size,
+            max_retries=retry or 0,
+        )
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        if not self.keep_alive:
+            session.headers["Connection"] = "close"
+        if self.compress:
+            # Google APIs only compress responses for user agents naming gzip
+            session.headers["Accept-Encoding"] = "gzip"
+            session.headers["User-Agent"] += " (gzip)"
+        else:
+            session.headers["Accept-Encoding"] = "identity"
+
+        with self.lock:
+            if self.pid != os.getpid():
+                self.pid, self.sessions, self.local_session = os.getpid(), [], None
+            self.sessions.append(session)
+
+        return session
+
+    def session(self) -> requests.Session:
+        """Returns the session of this process, creating it if needed."""
+        session = self.local_session
+        if session is None or self.pid != os.getpid():
+            session = self.create_session()
+            self.local_session = session
+
+        return session
+
+    def stats(self) -> Dict[str, int]:
+        """Counts the connections of this process' pools, in use or idle."""
+        counts = {"in_use": 0, "idle": 0, "requests": 0}
+        with self.lock:
+            sessions = self.sessions if self.pid == os.getpid() else []
+            for session in sessions:
+                for adapter in set(session.adapters.values()):
+                    for key in adapter.poolmanager.pools.keys():
+                        pool = adapter.poolmanager.pools[key]
+                        if pool.pool is None:
+                            continue  # Closed
+                        idle = sum(conn is not None for conn in pool.pool.queue)
+                        counts["in_use"] += pool.pool.maxsize - pool.pool.qsize()
+                        counts["idle"] += idle
+                        counts["requests"] += pool.num_requests
+
+        return counts
@@ -0,0 +1,338 @@
+import heapq
+import logging
+import math
+import random
+import re
+import unicodedata
+from collections import defaultdict
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple
+
+import snowballstemmer
+from arango.typings import Json
+
+from server import snapshot
+from server.typings import (
+    ArangoImage,
+    ArangoImageInfo,
+    ArangoSearchMatches,
+    Suggestion,
+)
+
+# Words, keeping inner dots & apostrophes like ICU does ("stock.xchng", "o'neil")
+WORD = re.compile(r"\w+(?:[.'’]\w+)*")
+EARTH_RADIUS = 6371000  # In meters, as used by GEO_DISTANCE
+
+
+class MemoryGraph:
+    """A read-only copy of the graph, answering the search & image info
+    queries of server/aql.py in-process, with the same semantics.
+
+    Loaded from a backup/ directory: an inverted index over the analyzed
+    Tag, Author & BestGuess texts stands in for `searchview`, and adjacency
+    lists of (vertex, edge) pairs for the graph traversals. The SimilarTo
+    edges are computed on first use, as in ArangoDriver.refresh_similarity.
+    """
+
+    SEARCH_FIELDS = {"Tag": "tag", "BestGuess": "bestGuess", "Author": "author"}
+    EDGE_COLLECTIONS = ["AuthorOf", "TagOf", "BestGuessOf"]
+    BOOSTS = {"bestGuess": 2, "tag": 3, "author": 4}
+    BM25_K, BM25_B = 2.4, 1
+    SIMILARITY_TOP_K = 12
+
+    def __init__(self, backup_dir: str, stop_words: Sequence[str] = ()) -> None:
+        self.stemmer = snowballstemmer.stemmer("english")
+        self.stop_words = set(stop_words)
+        self.documents: Dict[str, Json] = {}
+        self.inbound: Dict[str, List[Tuple[str, Json]]] = defaultdict(list)
+        self.outbound: Dict[str, List[Tuple[str, Json]]] = defaultdict(list)
+        self.similar: Dict[str, List[Tuple[str, float]]] = {}
+
+        self.generation = snapshot.generation(backup_dir)
+
+        for collection in self.SEARCH_FIELDS.keys() | {"Image"}:
+            for doc in self.load(backup_dir, collection):
+                self.documents[doc["_id"]] = doc
+
+        for collection in self.EDGE_COLLECTIONS:
+            for edge in self.load(backup_dir, collection):
+                if edge["_from"] not in self.documents:
+                    continue
+                if edge["_to"] not in self.documents:
+                    continue
+
+                self.outbound[edge["_from"]].append((edge["_to"], edge))
+                self.inbound[edge["_to"]].append((edge["_from"], edge))
+
+        self.image_ids = [i for i in self.documents if i.startswith("Image/")]
+        # What the TagOf geo index holds
+        self.located = [
+            e for edges in self.inbound.values() for _, e in edges if e.get("_location")
+        ]
+        self.index_documents()
+        logging.info(f"Memory: {len(self.documents)} documents from {backup_dir}")
+
+    @staticmethod
+    def load(backup_dir: str, collection: str) -> Iterator[Json]:
+        path = snapshot.collection_path(backup_dir, collection)
+        if path is None:
+            logging.warning(f"No backup for {collection}, skipping")
+            return iter([])
+
+        return snapshot.read_collection(path, collection)
+
+    def index_documents(self) -> None:
+        """Builds the exact (norm_accent_lower) & close (text_en) indexes."""
+        self.exact: Dict[str, List[str]] = defaultdict(list)
+        self.postings: Dict[Tuple[str, str], Dict[str, int]] = defaultdict(dict)
+        self.lengths: Dict[str, Dict[str, int]] = defaultdict(dict)
+
+        for doc_id, doc in self.documents.items():
+            field = self.SEARCH_FIELDS.get(doc_id.split("/")[0])
+            if field is None or not isinstance(doc.get(field), str):
+                continue
+
+            self.exact[self.normalize(doc[field])].append(doc_id)
+            tokens = self.tokenize(doc[field])
+            self.lengths[field][doc_id] = len(tokens)
+            for token in tokens:
+                freqs = self.postings[(field, token)]
+                freqs[doc_id] = freqs.get(doc_id, 0) + 1
+
+        self.doc_count = sum(len(lengths) for lengths in self.lengths.values())
+        self.avg_lengths = {
+            field: sum(lengths.values()) / len(lengths)
+            for field, lengths in self.lengths.items()
+        }
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """Lowercases, as the norm_accent_lower analyzer, which keeps accents
+        (see scripts/onboard.py)."""
+        return unicodedata.normalize("NFC", text.lower())
+
+    @staticmethod
+    def strip_accents(text: str) -> str:
+        """Lowercases & strips accents, as text analyzers do by default."""
+        decomposed = unicodedata.normalize("NFKD", text.lower())
+        return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+    def tokenize(self, text: str, stop_words: Iterable[str] = ()) -> List[str]:
+        """Splits into stemmed words, as the text_en (& text_en_stopwords) analyzer."""
+        words = [
+            w for w in WORD.findall(self.strip_accents(text)) if w not in stop_words
+        ]
+        return self.stemmer.stemWords(words)
+
+    def search(self, keyword: str, max_results: int) -> ArangoSearchMatches:
+        exact_rows = [
+            (edge["_score"], image_id)
+            for doc_id in self.exact.get(self.normalize(keyword), [])
+            for image_id, edge in self.unique(self.outbound[doc_id])
+        ]
+        exact_rows.sort(key=lambda row: row[0], reverse=True)
+
+        close_docs = self.rank(self.tokenize(keyword, self.stop_words))
+        counts: Dict[str, int] = defaultdict(int)
+        for doc_id in close_docs:
+            for image_id, _ in self.unique(self.outbound[doc_id]):
+                counts[image_id] += 1
+        close_rows = sorted(counts, key=counts.get, reverse=True)
+
+        return {
+            "exact": [self.key(i) for _, i in exact_rows[:max_results]],
+            "close": [self.key(i) for i in close_rows[:max_results]],
+            "matches": close_docs,
+        }
+
+    def images(self, image_keys: List[str]) -> List[ArangoImage]:
+        image_ids = [f"Image/{key}" for key in image_keys]
+        return [self.documents[i] for i in image_ids if i in self.documents]
+
+    def rank(self, tokens: List[str]) -> List[str]:
+        """Returns the documents matching any token, sorted by BM25(doc, 2.4, 1)."""
+        k, b = self.BM25_K, self.BM25_B
+        scores: Dict[str, float] = defaultdict(float)
+        for field, boost in self.BOOSTS.items():
+            for token in set(tokens):
+                freqs = self.postings.get((field, token), {})
+                n = len(freqs)
+                idf = math.log1p((self.doc_count - n + 0.5) / (n + 0.5))
+                for doc_id, tf in freqs.items():
+                    length = self.lengths[field][doc_id] / self.avg_lengths[field]
+                    tf_score = tf * (k + 1) / (tf + k * (1 - b + b * length))
+                    scores[doc_id] += boost * idf * tf_score
+
+        return sorted(scores, key=scores.get, reverse=True)
+
+    def suggestions(self) -> Iterator[Suggestion]:
+        """Yields the Tag, Author & BestGuess names, with their image count."""
+        for doc_id, doc in self.documents.items():
+            field = self.SEARCH_FIELDS.get(doc_id.split("/")[0])
+            count = len(self.distinct(i for i, _ in self.outbound.get(doc_id, [])))
+            if field is not None and isinstance(doc.get(field), str) and count:
+                yield {"name": doc[field], "type": field, "count": count}
+
+    def surprise_tags(self, max_results: int, ignored_words: Sequence[str]) -> str:
+        if not self.image_ids:
+            return ""  # As the AQL query, finding no image
+
+        image_id = random.choice(self.image_ids)
+        tags = [
+            self.documents[tag_id]["tag"]
+            for tag_id, edge in self.inbound[image_id]
+            if tag_id.startswith("Tag/")
+            and self.documents[tag_id]["tag"].lower() not in ignored_words
+            and edge["_score"] >= 0.60
+        ]
+        return " ".join(random.sample(tags, min(max_results, len(tags))))
+
+    def images_info(self, img_ids: List[str]) -> Dict[str, ArangoImageInfo]:
+        infos = {}
+        for img_id in img_ids:
+            image = self.documents.get(f"Image/{img_id}")
+            if image is None:
+                continue
+
+            neighbours = self.inbound[image["_id"]]
+            tags = [
+                {"_id": v, "tag": self.documents[v]["tag"], "score": e["_score"]}
+                for v, e in neighbours
+                if v.startswith("Tag/")
+            ]
+            infos[img_id] = {
+                "image": image,
+                "bestGuess": [
+                    self.documents[v]["bestGuess"]
+                    for v, _ in neighbours
+                    if v.startswith("BestGuess/")
+                ],
+                "tags": sorted(tags, key=lambda tag: tag["score"], reverse=True),
+                "similar": self.discovery([img_id]),
+            }
+
+        return infos
+
+    def discovery(self, clicked_images: List[str]) -> List[ArangoImage]:
+        """Mirrors DISCOVERY_AQL in server/aql.py."""
+        clicked_ids = [f"Image/{key}" for key in clicked_images]
+        clicked_ids = [i for i in clicked_ids if i in self.documents]
+        clicked = set(clicked_ids)
+
+        weights: Dict[str, float] = defaultdict(float)
+        for image_id in clicked_ids:
+            for neighbour, score in self.similar_to(image_id):
+                if neighbour not in clicked:
+                    weights[neighbour] += score
+        common = heapq.nlargest(6, weights, key=weights.get)
+
+        localization_rows = []
+        for image_id in clicked_ids:
+            for tag_id, e1 in self.inbound[image_id]:
+                if not tag_id.startswith("Tag/") or e1.get("_type") != "object":
+                    continue
+                if self.documents[tag_id]["tag"] in ["Person", "Building", "Lighting"]:
+                    continue
+                if e1["_score"] <= 0.75:
+                    continue
+
+                for other_id, e2 in self.outbound[tag_id]:
+                    if other_id in clicked or e2.get("_type") != "object":
+                        continue
+                    if e2["_score"] > 0.80 and lines_intersect(
+                        e1["_coord"], e2["_coord"]
+                    ):
+                        localization_rows.append((e2["_score"], other_id))
+        localization_rows.sort(key=lambda row: row[0], reverse=True)
+        localization = self.distinct(i for _, i in localization_rows[:4])
+
+        landmark_rows = []
+        for image_id in clicked_ids:
+            for _, e1 in self.inbound[image_id]:
+                if e1.get("_type") != "landmark" or not e1.get("_location"):
+                    continue
+
+                for e2 in self.located:
+                    distance = geo_distance(e1["_location"], e2["_location"])
+                    if distance < 1000 and e2["_to"] != image_id:
+                        if e2["_to"] not in clicked:
+                            landmark_rows.append((distance, e2["_to"]))
+        landmark_rows.sort(key=lambda row: row[0])
+        landmark = self.distinct(i for _, i in landmark_rows)
+
+        similar = self.distinct(landmark + localization + common)
+        return [self.documents[i] for i in similar]
+
+    def similar_to(self, image_id: str) -> List[Tuple[str, float]]:
+        """The SimilarTo edges of an image, see ArangoDriver.refresh_similarity."""
+        if image_id not in self.similar:
+            weights: Dict[str, float] = defaultdict(float)
+            for vertex_id, e1 in self.inbound[image_id]:
+                for other_id, e2 in self.outbound[vertex_id]:
+                    if other_id != image_id:
+                        weights[other_id] += e1["_score"] * e2["_score"]
+
+            top = heapq.nlargest(self.SIMILARITY_TOP_K, weights, key=weights.get)
+            self.similar[image_id] = [(i, weights[i]) for i in top]
+
+        return self.similar[image_id]
+
+    @staticmethod
+    def unique(neighbours: List[Tuple[str, Json]]) -> Iterable[Tuple[str, Json]]:
+        """Visits each vertex once, as a traversal with uniqueVertices: 'global'."""
+        seen = set()
+        for vertex_id, edge in neighbours:
+            if vertex_id not in seen:
+                seen.add(vertex_id)
+                yield vertex_id, edge
+
+    @staticmethod
+    def distinct(ids: Iterable[str]) -> List[str]:
+        return list(dict.fromkeys(ids))
+
+    @staticmethod
+    def key(doc_id: str) -> str:
+        return doc_id.split("/", 1)[1]
+
+
+def geo_distance(a: Json, b: Json) -> float:
+    """Haversine distance in meters between two GeoJSON points."""
+    lng1, lat1 = map(math.radians, a["coordinates"])
+    lng2, lat2 = map(math.radians, b["coordinates"])
+    h = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(h))
+
+
+def lines_intersect(a: List[List[float]], b: List[List[float]]) -> bool:
+    """Whether two polylines touch or cross. The bounding boxes of localized
+    objects span a fraction of a degree, so they are treated as planar."""
+    return any(
+        segments_intersect(p1, p2, q1, q2)
+        for p1, p2 in zip(a, a[1:])
+        for q1, q2 in zip(b, b[1:])
+    )
+
+
+def segments_intersect(p1, p2, q1, q2) -> bool:
+    def orientation(a, b, c) -> int:
+        cross = (b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0])
+        return (cross > 0) - (cross < 0)
+
+    def on_segment(a, b, c) -> bool:
+        return min(a[0], b[0]) <= c[0] <= max(a[0], b[0]) and min(a[1], b[1]) <= c[
+            1
+        ] <= max(a[1], b[1])
+
+    o1, o2 = orientation(p1, p2, q1), orientation(p1, p2, q2)
+    o3, o4 = orientation(q1, q2, p1), orientation(q1, q2, p2)
+    if o1 != o2 and o3 != o4:
+        return True
+
+    return (
+        (o1 == 0 and on_segment(p1, p2, q1))
+        or (o2 == 0 and on_segment(p1, p2, q2))
+        or (o3 == 0 and on_segment(q1, q2, p1))
+        or (o4 == 0 and on_segment(q1, q2, p2))
+    )
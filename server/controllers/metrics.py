@@ -0,0 +1,207 @@
+import bisect
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List
+
+from server.controllers.cache import SQLiteStore
+
+# Upper bounds (in ms) of the latency histogram buckets, the last one catching all
+BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000]
+
+
+class Histogram:
+    def __init__(self, counts: List[int] = None, total: float = 0.0) -> None:
+        self.counts = counts or [0] * (len(BUCKETS) + 1)
+        self.total = total
+
+    def observe(self, ms: float) -> None:
+        self.counts[bisect.bisect_left(BUCKETS, ms)] += 1
+        self.total += ms
+
+    def merge(self, other: "Histogram") -> None:
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.total += other.total
+
+    def percentile(self, q: float) -> float:
+        """Returns the upper bound of the bucket holding the q-th percentile."""
+        rank = q * sum(self.counts)
+        seen = 0
+        for bound, count in zip(BUCKETS + [float("inf")], self.counts):
+            seen += count
+            if count and seen >= rank:
+                return bound
+
+        return 0
+
+    def summary(self) -> Dict[str, float]:
+        count = sum(self.counts)
+        return {
+            "count": count,
+            "mean": round(self.total / count, 2) if count else 0,
+            "p50": self.percentile(0.50),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+        }
+
+
+class Metrics:
+    """Collects serving statistics: request latencies per route, query latencies
+    per named query, running totals (e.g. documents scanned per named query),
+    and the counters of registered stats providers.
+
+    Each worker aggregates in memory and writes its totals to a SQLite file
+    every `flush_interval` seconds. A summary merges the totals of every
+    worker of the host. Stats providers are only read from live workers,
+    and the totals of exited workers are folded into the rows of pid 0.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS metrics (
+            pid INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            name TEXT NOT NULL,
+            value TEXT NOT NULL,
+            updated REAL NOT NULL,
+            PRIMARY KEY (pid, kind, name)
+        );
+    """
+
+    def __init__(self, path: str, flush_interval: float = 5.0) -> None:
+        self.store = SQLiteStore(path, self.SCHEMA)
+        self.flush_interval = flush_interval
+        self.histograms: Dict[str, Dict[str, Histogram]] = defaultdict(dict)
+        self.totals: Dict[str, Dict[str, Dict[str, float]]] = defaultdict(dict)
+        self.providers: Dict[str, Callable[[], Dict[str, int]]] = {}
+        self.last_flush = time.monotonic()
+        self.lock = threading.Lock()
+
+    def observe(self, kind: str, name: str, ms: float) -> None:
+        with self.lock:
+            self.histograms[kind].setdefault(name, Histogram()).observe(ms)
+
+        if time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def add(self, kind: str, name: str, counts: Dict[str, float]) -> None:
+        with self.lock:
+            totals = self.totals[kind].setdefault(name, defaultdict(float))
+            for counter, count in counts.items():
+                totals[counter] += count
+
+    def register(self, name: str, provider: Callable[[], Dict[str, int]]) -> None:
+        self.providers[name] = provider
+
+    def flush(self) -> None:
+        now, pid = time.time(), os.getpid()
+        with self.lock:
+            self.last_flush = time.monotonic()
+            rows = [
+                (pid, kind, name, json.dumps([h.counts, h.total]), now)
+                for kind, histograms in self.histograms.items()
+                for name, h in histograms.items()
+            ]
+            rows += [
+                (pid, f"totals:{kind}", name, json.dumps(counts), now)
+                for kind, totals in self.totals.items()
+                for name, counts in totals.items()
+            ]
+
+        for name, provider in self.providers.items():
+            rows.append((pid, "stats", name, json.dumps(provider()), now))
+
+        conn = self.store.connection()
+        conn.executemany("REPLACE INTO metrics VALUES (?, ?, ?, ?, ?)", rows)
+        conn.commit()
+
+    def compact(self) -> None:
+        """Folds the rows of the workers that exited into pid 0's, so that
+        worker restarts do not grow the table."""
+        conn = self.store.connection()
+        conn.execute("BEGIN IMMEDIATE")  # Keeps other workers from folding too
+        try:
+            pids = [
+                pid
+                for (pid,) in conn.execute("SELECT DISTINCT pid FROM metrics")
+                if pid != 0 and not process_alive(pid)
+            ]
+            for pid in pids:
+                for kind, name, value in conn.execute(
+                    "SELECT kind, name, value FROM metrics WHERE pid = ?", (pid,)
+                ).fetchall():
+                    if kind == "stats":
+                        continue
+
+                    row = conn.execute(
+                        "SELECT value FROM metrics WHERE pid = 0 AND kind = ? AND name = ?",
+                        (kind, name),
+                    ).fetchone()
+                    value = json.loads(value)
+                    if row is not None and kind.startswith("totals:"):
+                        for counter, count in json.loads(row[0]).items():
+                            value[counter] = value.get(counter, 0) + count
+                    elif row is not None:
+                        h = Histogram(*value)
+                        h.merge(Histogram(*json.loads(row[0])))
+                        value = [h.counts, h.total]
+
+                    conn.execute(
+                        "REPLACE INTO metrics VALUES (0, ?, ?, ?, ?)",
+                        (kind, name, json.dumps(value), time.time()),
+                    )
+
+                conn.execute("DELETE FROM metrics WHERE pid = ?", (pid,))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+    def summary(self) -> Dict[str, Dict[str, dict]]:
+        self.flush()
+        self.compact()
+        live_since = time.time() - 3 * self.flush_interval
+
+        histograms: Dict[str, Dict[str, Histogram]] = defaultdict(dict)
+        stats: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        totals: Dict[str, Dict[str, Dict[str, float]]] = defaultdict(
+            lambda: defaultdict(lambda: defaultdict(float))
+        )
+        for kind, name, value, updated in self.store.connection().execute(
+            "SELECT kind, name, value, updated FROM metrics"
+        ):
+            if kind == "stats":
+                if updated >= live_since:
+                    for counter, count in json.loads(value).items():
+                        stats[name][counter] += count
+            elif kind.startswith("totals:"):
+                for counter, count in json.loads(value).items():
+                    totals[kind[len("totals:") :]][name][counter] += count
+            else:
+                h = histograms[kind].setdefault(name, Histogram())
+                h.merge(Histogram(*json.loads(value)))
+
+        summary = {
+            kind: {name: h.summary() for name, h in sorted(named.items())}
+            for kind, named in histograms.items()
+        }
+        for kind, named in totals.items():
+            summary[kind] = {
+                name: {counter: round(count, 2) for counter, count in counts.items()}
+                for name, counts in sorted(named.items())
+            }
+        summary["stats"] = {name: dict(counters) for name, counters in stats.items()}
+        return summary
+
+
+def process_alive(pid: int) -> bool:
+    """Whether a process of this host is running, as metrics are per host."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # Another user's
+
+    return True
@@ -0,0 +1,65 @@
+import threading
+from collections import defaultdict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class Flight:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Coalesces concurrent calls: while a call for a (name, key) is running,
+    the threads making the same call wait for its outcome instead of running
+    it again. Nothing is kept once the call returns, see ResultCache for that.
+
+    Calls are only shared within a worker, as they are made by its threads.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.flights: Dict[Tuple[str, Hashable], Flight] = {}
+        self.counters: Dict[str, Dict[str, int]] = defaultdict(
+            lambda: {"calls": 0, "coalesced": 0}
+        )
+
+    def do(self, name: str, key: Hashable, fn: Callable[[], T]) -> T:
+        """Returns fn(), or the result of the identical call in flight.
+        An exception raised by the call is raised in every waiting thread."""
+        with self.lock:
+            self.counters[name]["calls"] += 1
+            flight = self.flights.get((name, key))
+            if flight is not None:
+                self.counters[name]["coalesced"] += 1
+            else:
+                self.flights[(name, key)] = leader = Flight()
+
+        if flight is not None:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            leader.result = fn()
+            return leader.result
+        except BaseException as e:
+            leader.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[(name, key)]
+            leader.done.set()
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            stats = {"in_flight": len(self.flights)}
+            for name, counters in self.counters.items():
+                for counter, count in counters.items():
+                    stats[f"{name}.{counter}"] = count
+
+        return stats
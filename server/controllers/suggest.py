@@ -0,0 +1,106 @@
+import bisect
+import heapq
+import logging
+import threading
+import unicodedata
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+from server.typings import Suggestion
+
+# Sorts after any character a name may continue a prefix with
+END = "\U0010ffff"
+
+
+class SuggestIndex:
+    """Completes prefixes into Tag, Author & BestGuess names, in-process.
+
+    Keeps a sorted list of the normalized names, and of their word-starting
+    suffixes, so that "york" also suggests "New York". The names starting
+    with a prefix are a range of the list, found by bisection, whose most
+    used names (by image count) are returned. The top names of the one &
+    two letter prefixes, the largest ranges, are precomputed. The index is
+    rebuilt whenever the dataset generation changes.
+    """
+
+    MAX_SUGGESTIONS = 20
+    PRECOMPUTED_LENGTH = 2
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.generation: Optional[int] = None
+        # (sorted keys, suggestion of each key, precomputed tops, suggestions
+        # by decreasing count), swapped in at once
+        self.state: tuple = ([], [], {}, [])
+
+    def suggest(self, prefix: str, k: int) -> List[Suggestion]:
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+
+        keys, ranks, tops, suggestions = self.state
+        if len(prefix) <= self.PRECOMPUTED_LENGTH:
+            return [suggestions[rank] for rank in tops.get(prefix, [])[:k]]
+
+        start = bisect.bisect_left(keys, prefix)
+        end = bisect.bisect_left(keys, prefix + END, start)
+        # Suggestions are ranked by count, so the best are the smallest ranks
+        best = heapq.nsmallest(k, set(ranks[start:end]))
+        return [suggestions[rank] for rank in best]
+
+    def refresh(
+        self, generation: int, load: Callable[[], Iterable[Suggestion]]
+    ) -> None:
+        if generation == self.generation:
+            return
+
+        with self.lock:
+            if generation == self.generation:
+                return
+
+            # Names are shown once, as their most used Tag, Author or BestGuess
+            by_name: Dict[str, Suggestion] = {}
+            for suggestion in load():
+                name = normalize(suggestion["name"])
+                other = by_name.get(name)
+                if name and (other is None or other["count"] < suggestion["count"]):
+                    by_name[name] = suggestion
+
+            ranked = sorted(by_name.items(), key=lambda item: -item[1]["count"])
+            entries = sorted(
+                (key, rank)
+                for rank, (name, _) in enumerate(ranked)
+                for key in word_suffixes(name)
+            )
+            keys = [key for key, _ in entries]
+            ranks = [rank for _, rank in entries]
+
+            candidates: Dict[str, Set[int]] = defaultdict(set)
+            for key, rank in entries:
+                for length in range(1, min(len(key), self.PRECOMPUTED_LENGTH) + 1):
+                    candidates[key[:length]].add(rank)
+            tops = {
+                prefix: heapq.nsmallest(self.MAX_SUGGESTIONS, prefix_ranks)
+                for prefix, prefix_ranks in candidates.items()
+            }
+
+            suggestions = [suggestion for _, suggestion in ranked]
+            self.state = (keys, ranks, tops, suggestions)
+            self.generation = generation
+            logging.info(
+                f"Suggest: {len(suggestions)} names, {len(keys)} keys "
+                f"(generation {generation})"
+            )
+
+
+def normalize(text: str) -> str:
+    """Lowercases, strips accents & collapses whitespace."""
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return " ".join(text.split())
+
+
+def word_suffixes(name: str) -> List[str]:
+    """Returns the name from each of its words on: "new york" & "york"."""
+    words = name.split(" ")
+    return [" ".join(words[i:]) for i in range(len(words))]
@@ -0,0 +1,19 @@
+"""Document keys of the Author, Tag & BestGuess vertices and of their edges.
+
+Keys are the first KEY_LENGTH hex digits of a SHA-1, so that they have a fixed
+width whatever the label, and that AQL can derive them too:
+SUBSTRING(SHA1(label), 0, 16) (see scripts/migrate_keys.py).
+"""
+
+import hashlib
+
+KEY_LENGTH = 16
+
+
+def vertex_key(label: str) -> str:
+    return hashlib.sha1(label.encode()).hexdigest()[:KEY_LENGTH]
+
+
+def edge_key(from_key: str, to_key: str) -> str:
+    # The separator keeps ("1", "23") & ("12", "3") apart
+    return vertex_key(f"{from_key}-{to_key}")
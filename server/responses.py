@@ -0,0 +1,116 @@
+import gzip
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from flask import Response, request
+
+from server.controllers.arangodb import query_debug
+
+# (status, body, gzipped body if worth it)
+Encoded = Tuple[int, bytes, Optional[bytes]]
+
+
+def encode_json(payload: Any) -> bytes:
+    return json.dumps(payload, separators=(",", ":")).encode()
+
+
+class ResponseCache:
+    """Builds JSON responses from payloads encoded once, with `encode`.
+
+    Cacheable payloads only depend on the dataset generation & the request
+    arguments, which their ETag is derived from. A conditional GET for the
+    current ETag is answered with a 304, without building the payload, and
+    the `max_entries` most recently used bodies are kept encoded (and
+    gzipped past `gzip_min_bytes`) in memory, for the clients without it.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        gzip_min_bytes: int = 1024,
+        encode: Callable[[Any], bytes] = encode_json,
+    ) -> None:
+        self.max_entries = max_entries
+        self.gzip_min_bytes = gzip_min_bytes
+        self.encode = encode
+        self.bodies: "OrderedDict[str, Encoded]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "not_modified": 0}
+
+    def cached(
+        self, generation: int, key: str, build: Callable[[], Tuple[Any, int]]
+    ) -> Response:
+        """Returns the response for `key` at `generation`, calling build()
+        for its (payload, status) if needed. Only 2xx responses are kept."""
+        if query_debug.get() is not None:
+            return self.response(*build())  # Carries the debug info of its queries
+
+        digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+        etag = f"{generation:x}-{digest}"
+        if request.if_none_match.contains_weak(etag):
+            self.count("not_modified")
+            response = Response(status=304)
+            response.set_etag(etag, weak=True)
+            return response
+
+        with self.lock:
+            encoded = self.bodies.get(etag)
+            if encoded is not None:
+                self.bodies.move_to_end(etag)
+                self.counters["hits"] += 1
+
+        if encoded is None:
+            self.count("misses")
+            encoded = self.encoded(*build())
+            if 200 <= encoded[0] < 300:
+                with self.lock:
+                    self.bodies[etag] = encoded
+                    while len(self.bodies) > self.max_entries:
+                        self.bodies.popitem(last=False)
+
+        response = self.send(encoded)
+        # Weak, as the gzipped & plain bodies are the same representation
+        response.set_etag(etag, weak=True)
+        response.headers["Cache-Control"] = "no-cache"  # Revalidate every time
+        return response
+
+    def response(self, payload: Any, status: int = 200) -> Response:
+        """Returns an uncached response, gzipped if large."""
+        if query_debug.get() is not None:
+            return Response(encode_json(payload), status, mimetype="application/json")
+
+        return self.send(self.encoded(payload, status))
+
+    def encoded(self, payload: Any, status: int) -> Encoded:
+        body = self.encode(payload)
+        gzipped = None
+        if len(body) >= self.gzip_min_bytes:
+            gzipped = gzip.compress(body, compresslevel=6, mtime=0)
+            if len(gzipped) >= len(body):
+                gzipped = None
+
+        return status, body, gzipped
+
+    def send(self, encoded: Encoded) -> Response:
+        status, body, gzipped = encoded
+        use_gzip = gzipped is not None and request.accept_encodings["gzip"]
+        response = Response(
+            gzipped if use_gzip else body, status, mimetype="application/json"
+        )
+        if gzipped is not None:
+            response.vary.add("Accept-Encoding")
+        if use_gzip:
+            response.headers["Content-Encoding"] = "gzip"
+
+        return response
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {**self.counters, "entries": len(self.bodies)}
+
+    def count(self, counter: str) -> None:
+        with self.lock:
+            self.counters[counter] += 1
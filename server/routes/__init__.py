@@ -1,4 +1,10 @@
-from flask import Flask
+import json
+import time
+
+from flask import Flask, g, request
+
+from server import metrics, query_debug_enabled
+from server.controllers.arangodb import query_debug
 
 from .info import info_bp
 from .search import search_bp
@@ -8,3 +14,39 @@ def init_app(app: Flask):
     url_prefix = "/api"
     app.register_blueprint(info_bp, url_prefix=url_prefix)
     app.register_blueprint(search_bp, url_prefix=url_prefix)
+
+    app.before_request(start_timer)
+    app.after_request(record_latency)
+    app.after_request(attach_query_debug)
+
+
+def start_timer():
+    g.request_start = time.perf_counter()
+    debug = query_debug_enabled and request.args.get("debug") == "1"
+    g.query_debug_token = query_debug.set([] if debug else None)
+
+
+def attach_query_debug(response):
+    """Adds the profile & plan of the request's queries to its JSON response."""
+    if "query_debug_token" in g:
+        debug = query_debug.get()
+        query_debug.reset(g.pop("query_debug_token"))
+        # Files (e.g. static assets) are streamed, and cannot be read here
+        if debug is None or response.direct_passthrough or response.is_streamed:
+            return response
+
+        body = response.get_json(silent=True)
+        if isinstance(body, dict):
+            body["debug"] = debug
+            response.set_data(json.dumps(body))
+
+    return response
+
+
+def record_latency(response):
+    if "request_start" in g:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        ms = (time.perf_counter() - g.request_start) * 1000
+        metrics.observe("routes", f"{request.method} {route}", ms)
+
+    return response
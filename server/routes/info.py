@@ -1,7 +1,7 @@
 from flask import Blueprint, jsonify, request
 from flask_cors import cross_origin
 
-from server import aql
+from server import aql, metrics, response_cache
 
 info_bp = Blueprint("info_bp", __name__)
 
@@ -11,18 +11,37 @@ info_bp = Blueprint("info_bp", __name__)
 def fetch_image():
     img_id = request.args.get("id")
     if img_id and img_id.isdigit():
-        data = aql.fetch_image_info(img_id)
-        return jsonify({"data": data}), 200
+
+        def build():
+            return {"data": aql.fetch_image_info(img_id)}, 200
+
+        key = f"info/image:{img_id}"
+        return response_cache.cached(aql.dataset_generation(), key, build)
     else:
         return jsonify("User must pass image ID to view."), 400
 
 
+@info_bp.route("/info/images")
+@cross_origin()
+def fetch_images():
+    img_ids = request.args.get("ids", "").split(",")
+    if all(img_id.isdigit() for img_id in img_ids) and len(img_ids) <= 50:
+
+        def build():
+            return {"data": aql.fetch_images_info(img_ids)}, 200
+
+        key = f"info/images:{','.join(img_ids)}"
+        return response_cache.cached(aql.dataset_generation(), key, build)
+    else:
+        return jsonify("User must pass up to 50 comma-separated image IDs."), 400
+
+
 @info_bp.route("/info/randomtags")
 @cross_origin()
 def fetch_random_tags():
     keyword = aql.fetch_surprise_tags()
     if keyword:
-        return jsonify({"keyword": keyword}), 200
+        return response_cache.response({"keyword": keyword})
     else:
         return jsonify("Error fetching surprise keys"), 500
 
@@ -32,6 +51,6 @@ def fetch_random_tags():
 def fetch_metrics():
     data = aql.fetch_db_metrics()
     if data:
-        return jsonify({"data": data}), 200
+        return response_cache.response({"data": data, "serving": metrics.summary()})
     else:
         return jsonify("Error fetching metrics"), 500
@@ -3,7 +3,7 @@ from typing import List
 from flask import Blueprint, jsonify, request
 from flask_cors import cross_origin
 
-from server import aql, vision
+from server import aql, response_cache, suggest_index, vision
 from server.typings import Edge, Node, ParsedVisualzationData, VisualizationData
 
 search_bp = Blueprint("search_bp", __name__)
@@ -13,13 +13,52 @@ search_bp = Blueprint("search_bp", __name__)
 @cross_origin()
 def from_keyword():
     keyword = request.args.get("keyword")
+    limit = request.args.get("limit", aql.PAGE_SIZE, type=int)
+    if not 0 < limit <= aql.MAX_PAGE_SIZE:
+        return jsonify(f"Limit must be between 1 and {aql.MAX_PAGE_SIZE}"), 400
+
+    offset, generation = 0, aql.dataset_generation()
+    cursor = request.args.get("cursor")
+    if cursor:
+        page = aql.parse_cursor(cursor)
+        if page is None:
+            return jsonify("Invalid cursor"), 400
+
+        keyword, cursor_generation, offset = page
+        if cursor_generation != generation:
+            return jsonify("Search results changed, please search again"), 410
+
     if keyword:
-        images = aql.fetch_images(keyword)
-        return jsonify({"data": images}), 200 if images else 204
+        # Keeps the search handle alive, even if the response is not rebuilt
+        handle = aql.search_handle(keyword, generation)
+
+        def build():
+            page = aql.fetch_page(keyword, generation, limit, offset)
+            data = {
+                "data": page["images"],
+                "handle": handle,
+                "cursor": page["cursor"],
+            }
+            return data, 200 if page["images"] else 204
+
+        key = f"search/keyword:{limit}:{offset}:{aql.normalize_keyword(keyword)}"
+        return response_cache.cached(generation, key, build)
     else:
         return jsonify("User must pass a keyword as a string to search"), 400
 
 
+@search_bp.route("/search/suggest")
+@cross_origin()
+def from_prefix():
+    prefix = request.args.get("prefix", "")
+    limit = request.args.get("limit", 8, type=int)
+    if not 0 < limit <= suggest_index.MAX_SUGGESTIONS:
+        max_suggestions = suggest_index.MAX_SUGGESTIONS
+        return jsonify(f"Limit must be between 1 and {max_suggestions}"), 400
+
+    return response_cache.response({"data": aql.fetch_suggestions(prefix, limit)})
+
+
 @search_bp.route("/search/url")
 @cross_origin()
 def from_url():
@@ -29,11 +68,19 @@ def from_url():
 
     try:
         keyword = vision.generate_keyword_from_url(url)
+    except TimeoutError:
+        return jsonify("Google Vision timed out, please try again"), 504
     except:
         return jsonify("Unable to generate vision data from image url"), 500
 
-    images = aql.fetch_images(keyword)
-    return jsonify({"data": images, "keyword": keyword}), 200 if images else 204
+    result = aql.fetch_images(keyword)
+    data = {
+        "data": result["images"],
+        "keyword": keyword,
+        "handle": result["handle"],
+        "cursor": result["cursor"],
+    }
+    return response_cache.response(data, 200 if result["images"] else 204)
 
 
 @search_bp.route("/search/surpriseme")
@@ -41,8 +88,14 @@ def from_url():
 def from_surprise():
     keyword = aql.fetch_surprise_tags()
     if keyword:
-        images = aql.fetch_images(keyword)
-        return jsonify({"data": images, "keyword": keyword}), 200
+        result = aql.fetch_images(keyword)
+        data = {
+            "data": result["images"],
+            "keyword": keyword,
+            "handle": result["handle"],
+            "cursor": result["cursor"],
+        }
+        return response_cache.response(data)
     else:
         return jsonify("Error fetching surprise tags"), 500
 
@@ -52,22 +105,48 @@ def from_surprise():
 def from_discovery():
     clicked_images = request.args.get("IDs").split(",")
     if clicked_images:
-        discovery = aql.fetch_discovery(clicked_images)
-        return jsonify({"data": discovery}), 200 if discovery else 204
+
+        def build():
+            discovery = aql.fetch_discovery(clicked_images)
+            return {"data": discovery}, 200 if discovery else 204
+
+        key = f"search/discover:{','.join(sorted(set(clicked_images)))}"
+        return response_cache.cached(aql.dataset_generation(), key, build)
     else:
         return jsonify("Invalid image IDs"), 400
 
 
+@search_bp.route("/search/nearby")
+@cross_origin()
+def from_nearby():
+    lat = request.args.get("lat", type=float)
+    lng = request.args.get("lng", type=float)
+    radius = request.args.get("radius", 1000, type=float)
+    if lat is None or lng is None or not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return jsonify("User must pass a valid lat & lng"), 400
+
+    if not 0 < radius <= 50000:
+        return jsonify("Radius must be between 0 and 50000 meters"), 400
+
+    def build():
+        images = aql.fetch_nearby(lat, lng, radius)
+        return {"data": images}, 200 if images else 204
+
+    key = f"search/nearby:{lat},{lng},{radius}"
+    return response_cache.cached(aql.dataset_generation(), key, build)
+
+
 @search_bp.route("/search/visualizesearch", methods=["POST"])
 @cross_origin()
 def from_search_visualizer():
     body: dict = request.get_json()
     data: VisualizationData = {"vertices": [], "connections": []}
 
-    last_search = body.get("lastSearch")
-    last_result = body.get("lastResult")
-    if last_search and last_result:
-        data = aql.fetch_search_visualization(last_search, last_result)
+    handle = body.get("handle")
+    if handle:
+        data = aql.fetch_search_visualization(handle)
+        if data is None:
+            return jsonify("Search handle expired, please search again"), 410
 
     return visualize_data(data, True)
 
@@ -91,15 +170,12 @@ def from_image_visualizer():
 def visualize_data(data: VisualizationData, is_search_visualization):
     if data["vertices"] and data["connections"]:
         graph_object = parse_visualization_info(data, is_search_visualization)
-        return (
-            jsonify(
-                {
-                    "graphObject": graph_object,
-                    "verticeCount": len(data["vertices"]),
-                    "imageCount": len(data["connections"]),
-                }
-            ),
-            200,
+        return response_cache.response(
+            {
+                "graphObject": graph_object,
+                "verticeCount": len(data["vertices"]),
+                "imageCount": len(data["connections"]),
+            }
         )
     else:
         return jsonify("Invalid Visualization"), 400
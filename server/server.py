@@ -1,17 +1,30 @@
 import logging
 
-from server import app, routes
+from server import aql, app, routes, static_assets, suggest_warmup
 
 logger = logging.getLogger(__file__)
 
 routes.init_app(app)
+if static_assets is not None:
+    app.view_functions["static"] = static_assets.serve
+
+# Builds the suggestions once, before gunicorn forks its workers (--preload)
+if suggest_warmup:
+    try:
+        aql.refresh_suggestions()
+    except Exception:
+        logging.exception("Suggestions will be built on first use")
 
 
 @app.route("/")
 def serve():
+    if static_assets is not None:
+        return static_assets.index()
     return app.send_static_file("index.html")
 
 
 @app.errorhandler(404)
 def not_found(e):
+    if static_assets is not None:
+        return static_assets.index()
     return app.send_static_file("index.html")
@@ -0,0 +1,128 @@
+"""Reads the backups in backup/: either a manifest.json listing one gzipped
+NDJSON file per collection (see scripts/backup.py), or the original format of
+one JSON array per collection."""
+
+import gzip
+import hashlib
+import json
+import os
+from typing import Iterator, List, Optional
+
+from arango.typings import Json
+
+MANIFEST = "manifest.json"
+
+
+def load_manifest(backup_dir: str) -> Optional[Json]:
+    path = f"{backup_dir}/{MANIFEST}"
+    if not os.path.exists(path):
+        return None
+
+    with open(path) as file:
+        return json.load(file)
+
+
+def collection_path(backup_dir: str, collection: str) -> Optional[str]:
+    """Returns the backup file of a collection, or None if there is none."""
+    manifest = load_manifest(backup_dir)
+    if manifest is not None:
+        entry = manifest["collections"].get(collection)
+        return f"{backup_dir}/{entry['file']}" if entry else None
+
+    path = f"{backup_dir}/{collection}.json"
+    return path if os.path.exists(path) else None
+
+
+def read_collection(path: str, collection: str) -> Iterator[Json]:
+    """Yields the documents of a backup file one at a time, with their _id."""
+    docs = iter_ndjson(path) if path.endswith(".ndjson.gz") else iter_json_array(path)
+    for doc in docs:
+        doc.setdefault("_id", f"{collection}/{doc['_key']}")
+        yield doc
+
+
+def generation(backup_dir: str) -> int:
+    """The dataset generation the backup was taken at, or its age if unknown."""
+    manifest = load_manifest(backup_dir)
+    if manifest is not None:
+        return manifest["generation"]
+
+    files = [f"{backup_dir}/{f}" for f in os.listdir(backup_dir) if f.endswith(".json")]
+    if not files:
+        raise FileNotFoundError(f"No backup in {backup_dir}")
+
+    return int(max(os.path.getmtime(f) for f in files) * 1000)
+
+
+def verify(backup_dir: str) -> List[str]:
+    """Checks the row count & checksum of every file of the manifest.
+    Returns the problems found."""
+    manifest = load_manifest(backup_dir)
+    if manifest is None:
+        return []
+
+    problems = []
+    for collection, entry in manifest["collections"].items():
+        path = f"{backup_dir}/{entry['file']}"
+        if not os.path.exists(path):
+            problems.append(f"{collection}: {entry['file']} is missing")
+            continue
+
+        checksum, rows = hashlib.sha256(), 0
+        with gzip.open(path, "rb") as file:
+            for line in file:
+                checksum.update(line)
+                rows += 1
+
+        if rows != entry["rows"]:
+            problems.append(f"{collection}: {rows} rows, expected {entry['rows']}")
+        if checksum.hexdigest() != entry["sha256"]:
+            problems.append(f"{collection}: checksum mismatch")
+
+    return problems
+
+
+def iter_ndjson(path: str) -> Iterator[Json]:
+    with gzip.open(path, "rt", encoding="utf-8") as file:
+        for line in file:
+            yield json.loads(line)
+
+
+def iter_json_array(path: str, chunk_size: int = 1 << 16) -> Iterator[Json]:
+    """Parses a JSON array incrementally, reading `chunk_size` characters at a
+    time, so that memory use does not grow with the size of the file."""
+    decoder = json.JSONDecoder()
+    with open(path) as file:
+        buffer, pos, started = "", 0, False
+        while True:
+            chunk = file.read(chunk_size)
+            buffer = buffer[pos:] + chunk
+            pos = 0
+
+            while True:
+                while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                    pos += 1
+                if pos == len(buffer):
+                    break
+
+                if not started:
+                    if buffer[pos] != "[":
+                        raise ValueError(f"{path} is not a JSON array")
+                    started, pos = True, pos + 1
+                    continue
+
+                if buffer[pos] == "]":
+                    return
+
+                try:
+                    doc, end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    if not chunk:
+                        raise
+                    break  # The document continues in the next chunk
+
+                yield doc
+                pos = end
+
+            if not chunk:
+                raise ValueError(f"{path} ends before the JSON array does")
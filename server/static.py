@@ -0,0 +1,145 @@
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+from typing import Dict, List, Optional
+
+from flask import Response, abort, request, send_file
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:  # Only gzip variants then (pip install -e .[static])
+    brotli = None
+
+# CRA names the files of client/build/static/ after a hash of their content
+HASHED = re.compile(r"\.[0-9a-f]{8,}\.(chunk\.)?[a-z0-9]+$")
+COMPRESSIBLE = {".css", ".html", ".js", ".json", ".map", ".svg", ".txt", ".ico"}
+ENCODINGS = {"br": ".br", "gzip": ".gz"}  # In order of preference
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+class StaticAssets:
+    """Serves the client build from precompressed variants.
+
+    At startup, every compressible file of `build_dir` gets a .gz (and with
+    brotli installed, a .br) sibling, unless it already has an up to date one.
+    A request is then answered with the best variant the client accepts,
+    content-hashed files being cached by browsers for good. index.html, also
+    the fallback of every unknown path, is kept in memory.
+    """
+
+    def __init__(self, build_dir: str, min_bytes: int = 256) -> None:
+        self.build_dir = build_dir
+        self.min_bytes = min_bytes
+        # Encodings available for each path, relative to build_dir
+        self.variants: Dict[str, List[str]] = {}
+        self.index_variants: Dict[Optional[str], bytes] = {}
+        self.index_etag = ""
+        if not os.path.isdir(build_dir):
+            logging.warning(f"No client build in {build_dir}, run `yarn build`")
+            return
+
+        self.precompress()
+        with open(f"{build_dir}/index.html", "rb") as file:
+            index = file.read()
+        self.index_variants = {None: index, "gzip": gzip.compress(index, mtime=0)}
+        if brotli is not None:
+            self.index_variants["br"] = brotli.compress(index)
+        self.index_etag = hashlib.sha1(index).hexdigest()[:16]
+
+    def precompress(self) -> None:
+        compressed = 0
+        for root, _, files in os.walk(self.build_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                _, extension = os.path.splitext(name)
+                if extension not in COMPRESSIBLE:
+                    continue
+                if os.path.getsize(path) < self.min_bytes:
+                    continue
+
+                relative = os.path.relpath(path, self.build_dir).replace(os.sep, "/")
+                self.variants[relative] = [
+                    encoding
+                    for encoding in ENCODINGS
+                    if encoding == "gzip" or brotli is not None
+                ]
+                for encoding in self.variants[relative]:
+                    compressed += self.compress(path, encoding)
+
+        logging.info(
+            f"Static assets: {len(self.variants)} compressible files, "
+            f"{compressed} (re)compressed"
+        )
+
+    def compress(self, path: str, encoding: str) -> bool:
+        """Writes the variant of a file, unless it is up to date."""
+        target = f"{path}{ENCODINGS[encoding]}"
+        modified = os.path.getmtime(path)
+        if os.path.exists(target) and os.path.getmtime(target) >= modified:
+            return False
+
+        with open(path, "rb") as file:
+            data = file.read()
+        if encoding == "br":
+            data = brotli.compress(data)
+        else:
+            data = gzip.compress(data, compresslevel=9, mtime=0)
+
+        with open(f"{target}.tmp", "wb") as file:
+            file.write(data)
+        os.replace(f"{target}.tmp", target)
+        return True
+
+    def serve(self, filename: str) -> Response:
+        """Replaces Flask's static view."""
+        if filename == "index.html":
+            return self.index()
+
+        path = safe_join(self.build_dir, filename)
+        if path is None or not os.path.isfile(path):
+            abort(404)
+
+        mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        encoding = self.encoding(self.variants.get(filename, []))
+        hashed = HASHED.search(filename) is not None
+        response = send_file(
+            f"{path}{ENCODINGS[encoding]}" if encoding else path,
+            mimetype=mimetype,
+            conditional=True,
+            max_age=IMMUTABLE_MAX_AGE if hashed else None,
+        )
+        if hashed:
+            response.cache_control.immutable = True
+        if filename in self.variants:
+            response.vary.add("Accept-Encoding")
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+
+        return response
+
+    def index(self) -> Response:
+        if not self.index_variants:
+            return Response("The client is not built", 404)
+
+        encoding = self.encoding([e for e in self.index_variants if e])
+        etag = f"{self.index_etag}-{encoding}" if encoding else self.index_etag
+        response = Response(self.index_variants[encoding], mimetype="text/html")
+        response.set_etag(etag)
+        response.cache_control.no_cache = True  # Names the current hashed files
+        response.vary.add("Accept-Encoding")
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+
+        return response.make_conditional(request)
+
+    def encoding(self, available: List[str]) -> Optional[str]:
+        accepted = request.accept_encodings
+        for encoding in ENCODINGS:
+            if encoding in available and accepted[encoding]:
+                return encoding
+
+        return None
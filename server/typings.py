@@ -21,6 +21,32 @@ class ArangoImage(AbstractImage):
     url: str
 
 
+class ArangoSearchMatches(TypedDict):
+    exact: List[str]
+    close: List[str]
+    matches: List[str]
+
+
+class ArangoSearch(TypedDict):
+    ranked: List[str]
+    matches: List[str]
+
+
+class ArangoSearchPage(TypedDict):
+    images: List[ArangoImage]
+    cursor: Optional[str]
+
+
+class ArangoSearchResult(ArangoSearchPage):
+    handle: str
+
+
+class Suggestion(TypedDict):
+    name: str
+    type: str  # tag, author or bestGuess
+    count: int  # Number of images
+
+
 class Tag(TypedDict):
     _id: int
     score: float
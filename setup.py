@@ -26,5 +26,21 @@ setup(
             "black",
             "isort>=5.0.0",
         ],
+        "memory": [
+            "snowballstemmer==2.2.0",
+        ],
+        "discovery": [
+            "numpy>=1.21",
+            "scipy>=1.7",
+        ],
+        "async": [
+            "aiohttp>=3.8",
+        ],
+        "fast-json": [
+            "orjson>=3.6",
+        ],
+        "static": [
+            "brotli>=1.0",
+        ],
     },
 )